@@ -0,0 +1,260 @@
+'''Measures the throughput of the simulation, collision, inference and evolution code, without a window.
+
+    $ python -m benchmarks.run --output bench.json
+    $ python -m benchmarks.run --quick
+
+Every benchmark is swept over population size, track (saved/track plus procedurally
+generated tracks with more and more walls) and sensor count, and the results are written
+as JSON so that runs can be compared before and after engine changes.
+Car benchmarks need pyglet, and run in its headless (EGL) mode when there is no display.
+They are skipped (with the reason) when neither works.
+'''
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from racing import collision
+from racing import neural_network as nn
+from racing.aabb_tree import AABBTree
+from racing.bvh import BVH
+from racing.genetics import Breeder
+from racing.population import Population
+from racing.track import generate_track, load_track
+
+def measure(function, min_time=0.2):
+    '''Returns seconds per call of function, calling it repeatedly for at least min_time seconds.
+    '''
+
+    calls = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time or calls == 0:
+        function()
+        calls += 1
+
+    return elapsed / calls
+
+def get_tracks(quick):
+    '''Returns {name: (walls, start pose)} of every track to benchmark on.
+    '''
+
+    try:
+        with open('saved/setup.json') as f:
+            setup = json.load(f)
+            start = setup['x'], setup['y'], np.radians(setup['angle'])
+    except FileNotFoundError:
+        start = 650, 400, 0
+
+    tracks = {'saved/track': (load_track('saved/track'), start)}
+    for num_walls in ([1000] if quick else [100, 1000, 10000]):
+        tracks[f'generated-{num_walls}'] = generate_track(num_walls, seed=num_walls)
+
+    return tracks
+
+def sample_poses(walls, start, count, rng, seed):
+    '''Returns count poses (rows of x, y, angle) of random cars driving on the track,
+    so that benchmarks see the bounding boxes and walls real cars do.
+    '''
+
+    population = Population(*start, 200, breeder=Breeder(seed))
+    wall_tree = BVH(walls)
+    poses = [np.column_stack((population.pos, population.angle))]
+
+    for tick in range(200):
+        population.update(0.02, walls, wall_tree)
+        if tick % 5 == 0:
+            live = population.live()
+            poses.append(np.column_stack((population.pos[live], population.angle[live])))
+
+    poses = np.concatenate(poses)
+    return poses[rng.integers(len(poses), size=count)]
+
+def place(population, poses):
+    population.reset()
+    population.pos[:] = poses[:, :2]
+    population.angle[:] = poses[:, 2]
+    # Moving, so that cars are not killed for being too slow
+    population.vel[:] = np.column_stack((np.cos(poses[:, 2]), -np.sin(poses[:, 2]))) * 100
+
+def bench_population_update(walls, start, poses, num_sensors, seed, dtype=float):
+    population = Population(*start, len(poses), breeder=Breeder(seed), num_sensors=num_sensors, dtype=dtype)
+    wall_tree = BVH(walls)
+
+    def step():
+        place(population, poses)
+        population.update(0.02, walls, wall_tree)
+
+    seconds = measure(step)
+    return {'seconds_per_step': seconds, 'car_steps_per_second': len(poses) / seconds,
+            'bytes_per_car': population.bytes_per_car()}
+
+def load_car():
+    '''Returns the Car class, or the reason it cannot be used here.
+    '''
+
+    try:
+        import pyglet
+
+        # pyglet picks headless mode or not when its windowing modules are first imported, and a failed attempt
+        # to open a display cannot be undone, so the display is tried in another process
+        probe = subprocess.run([sys.executable, '-c', 'import pyglet.canvas; pyglet.canvas.get_display()'],
+                               capture_output=True, text=True)
+        if 'NoSuchDisplayException' in probe.stderr:
+            pyglet.options['headless'] = True
+
+        from racing.car import Car
+        Car(0, 0, 0)
+        return Car, None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+def bench_car_update(Car, walls, poses):
+    # Same as the old racing.py: one AABBTree of pyglet-like walls and one Car.update per car
+    class Wall:
+        def __init__(self, x, y, x2, y2):
+            self.x, self.y, self.x2, self.y2 = x, y, x2, y2
+
+    wall_tree = AABBTree()
+    for x, y, x2, y2 in walls:
+        wall_tree.add_leaf(wall_tree.get_bounding_box([[x, y], [x2, y2]]), Wall(x, y, x2, y2))
+
+    cars = []
+    for x, y, angle in poses:
+        cars.append(Car(x, y, angle))
+        cars[-1].vel = np.array([np.cos(angle), -np.sin(angle)]) * 100
+
+    def step():
+        car_points = [car.get_wall_points() for car in cars]
+        sensor_points = [car.get_sensor_points() for car in cars]
+        car_collisions = wall_tree.query([wall_tree.get_bounding_box(points) for points in car_points])
+        sensor_collisions = wall_tree.query([wall_tree.get_bounding_box(points + [car.pos])
+                                             for car, points in zip(cars, sensor_points)])
+        for i, car in enumerate(cars):
+            car.update(0.02, car_collisions[i], car_points[i], sensor_collisions[i], sensor_points[i])
+            car.reset()
+
+    seconds = measure(step)
+    return {'seconds_per_step': seconds, 'car_steps_per_second': len(poses) / seconds}
+
+def bench_tree_query(walls, start, poses, seed):
+    population = Population(*start, len(poses), breeder=Breeder(seed))
+    place(population, poses)
+    boxes = BVH.get_bounding_boxes(population.get_wall_points())
+
+    aabb_tree = AABBTree()
+    for i, (x, y, x2, y2) in enumerate(walls):
+        aabb_tree.add_leaf(aabb_tree.get_bounding_box([[x, y], [x2, y2]]), i)
+    bvh = BVH(walls)
+
+    box_tuples = [tuple(box) for box in boxes]
+    aabb_seconds = measure(lambda: aabb_tree.query(box_tuples))
+    bvh_seconds = measure(lambda: bvh.query(boxes))
+    offsets, _ = bvh.query(boxes)
+
+    return {'aabb_tree_boxes_per_second': len(boxes) / aabb_seconds,
+            'bvh_boxes_per_second': len(boxes) / bvh_seconds,
+            'mean_candidates_per_box': offsets[-1] / len(boxes)}
+
+def bench_collision(rng, pairs=10000):
+    segments = rng.uniform(0, 1000, (pairs, 4, 2))
+    few = segments[:1000]
+
+    def scalar_intersecting():
+        for p1, p2, p3, p4 in few:
+            collision.intersecting(p1, p2, p3, p4)
+
+    def scalar_get_intersection():
+        for p1, p2, p3, p4 in few:
+            collision.get_intersection(p1, p2, p3, p4)
+
+    p1, p2, p3, p4 = segments.transpose(1, 0, 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {'intersecting_calls_per_second': len(few) / measure(scalar_intersecting),
+                'get_intersection_calls_per_second': len(few) / measure(scalar_get_intersection),
+                'segments_intersecting_pairs_per_second':
+                    pairs / measure(lambda: collision.segments_intersecting(p1, p2, p3, p4)),
+                'intersection_distances_pairs_per_second':
+                    pairs / measure(lambda: collision.intersection_distances(p1, p2, p3, p4))}
+
+def bench_predict(size, num_sensors, rng):
+    layers = [num_sensors + 1, num_sensors + 4, num_sensors + 4, 2]
+    network = nn.NeuralNetwork(layers)
+    batched = nn.BatchedNeuralNetwork(layers, size, rng)
+    feed = rng.uniform(0, 150, (size, layers[0]))
+
+    return {'predict_seconds': measure(lambda: network.predict(feed[0])),
+            'batched_predict_seconds': measure(lambda: batched.predict(feed)),
+            'batched_predictions_per_second': size / measure(lambda: batched.predict(feed))}
+
+def bench_evolve(Car, size, seed):
+    population = Population(0, 0, 0, size, breeder=Breeder(seed))
+    parents = population.brain.get_flattened_hyperparams(0), population.brain.get_flattened_hyperparams(1)
+    results = {'population_evolve_seconds': measure(lambda: population.evolve(*parents))}
+
+    if Car is not None and size <= 1000:
+        cars = [Car(0, 0, 0) for _ in range(size)]
+
+        def evolve():
+            for car in cars:
+                car.evolve(*parents)
+
+        results['car_evolve_seconds'] = measure(evolve)
+
+    return results
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the simulation without a window.')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--quick', action='store_true', help='smaller sweeps, for a quick check')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    rng = np.random.default_rng(args.seed)
+    # NeuralNetwork and Car draw from the global generator
+    np.random.seed(args.seed)
+    sizes = [100, 1000] if args.quick else [100, 1000, 10000, 50000]
+    sensor_counts = [3, 7, 15]
+    tracks = get_tracks(args.quick)
+    Car, car_skipped = load_car()
+    results = []
+
+    def record(benchmark, params, metrics):
+        results.append({'benchmark': benchmark, **params, **metrics})
+        print(benchmark, params, {k: f'{v:.4g}' if isinstance(v, float) else v for k, v in metrics.items()})
+
+    record('collision', {}, bench_collision(rng))
+
+    for size in sizes:
+        for num_sensors in sensor_counts:
+            record('predict', {'size': size, 'sensors': num_sensors}, bench_predict(size, num_sensors, rng))
+        record('evolve', {'size': size}, bench_evolve(Car, size, args.seed))
+
+    for name, (walls, start) in tracks.items():
+        poses = sample_poses(walls, start, max(sizes), rng, args.seed)
+
+        for size in sizes:
+            params = {'track': name, 'walls': len(walls), 'size': size}
+            record('tree_query', params, bench_tree_query(walls, start, poses[:size], args.seed))
+            for num_sensors in sensor_counts:
+                record('population_update', {**params, 'sensors': num_sensors},
+                       bench_population_update(walls, start, poses[:size], num_sensors, args.seed))
+            # Compact (float32) populations, only with the default sensors to keep the sweep short
+            record('population_update', {**params, 'sensors': 7, 'dtype': 'float32'},
+                   bench_population_update(walls, start, poses[:size], 7, args.seed, np.float32))
+
+            if Car is None:
+                record('car_update', params, {'skipped': car_skipped})
+            elif size <= 1000:
+                record('car_update', params, bench_car_update(Car, walls, poses[:size]))
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=1)
+
+if __name__ == '__main__':
+    main()
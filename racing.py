@@ -1,11 +1,20 @@
 import json
+import os
+import time
 
 import numpy as np
 import pyglet
 from pyglet.window import mouse, key
 
-from racing import Car, AABBTree
+from racing import Population, BVH
 from racing import res
+from racing.cutoff import EarlyCutoff
+from racing.compiled_track import load_compiled_track
+from racing.population import get_parents
+from racing.profiling import Profiler, NullProfiler
+from racing.renderer import CarRenderer
+from racing.saving import BackgroundWriter, json_writer
+from racing.trajectory import Trajectories, TrajectoryRecorder
 
 ##### Setup #####
 
@@ -15,23 +24,47 @@ drawing_wall = False
 ghost_wall = None
 
 walls = []
-wall_tree = AABBTree()
+wall_segments = np.zeros((0, 4))
+wall_tree = BVH(wall_segments)
 wall_batch = pyglet.graphics.Batch()
 
-cars = []
+population = None
+car_renderer = None  # Draws the population, followed by the two parents as ghosts
 car_batch = pyglet.graphics.Batch()
+parent_poses = np.zeros((2, 3))  # x, y and angle (in radians) of the parents of the current generation
+parents_shown = False
+# Number of cars with the greatest (running) fitness to draw (cycled with N), None being every car
+DRAW_TOP = [None, 20, 2]
+draw_top_index = 0
+
+# Records the best cars of each generation while training, to replay them later
+recorder = None
+TRAJECTORY_DIR = 'saved/trajectories'
+replay = None  # Trajectories being replayed
+replay_generations = []  # Every generation with saved trajectories
+replay_renderer = None
+replay_time = 0
 
 start_car = pyglet.sprite.Sprite(res.car_img, x=window.width//2, y=window.height//2, subpixel=True)
-parent_car1 = pyglet.sprite.Sprite(res.ghost_car_img, batch=car_batch, subpixel=True)
-parent_car2 = pyglet.sprite.Sprite(res.ghost_car_img, batch=car_batch, subpixel=True)
-
 start_car.visible = False
-parent_car1.visible = False
-parent_car2.visible = False
 
 blind = False
 training = True
 train_time = 0
+cutoff = None  # Set (with C) to end generations once no live car can beat the best two
+
+# Constant delta time so fluctuations in framerate do not affect car.
+# This is evident when the same generation loops yet course of cars are different.
+SIM_DT = 0.02
+# Simulation speeds (cycled with F), None being as many steps as fit in a frame
+SPEEDS = [1, 10, None]
+# Longest time spent stepping in one frame, at any speed
+MAX_FRAME_STEP_TIME = 1/30
+speed_index = 0
+sim_time = 0  # Simulation time owed to the current speed
+
+# Saves files at the end of each generation without stalling the frame
+writer = BackgroundWriter()
 
 # Check if program has been run and set up before
 try:
@@ -39,7 +72,7 @@ try:
         setup = json.load(f)
         generation = setup['generation']
         start_car.update(setup['x'], setup['y'], setup['angle'])
-except:
+except FileNotFoundError:
     generation = 1
 
 pyglet.gl.glClearColor(0.5, 1, 0.5, 1)
@@ -70,9 +103,19 @@ best_fitness_label = pyglet.text.Label(font_name='Osaka-Mono', font_size=18, col
                                        x=10, y=window.height - 25, anchor_y='top')
 mean_fitness_label = pyglet.text.Label(font_name='Osaka-Mono', font_size=18, color=(0, 0, 128, 255), 
                                        x=10, y=window.height - 45, anchor_y='top')
+speed_label = pyglet.text.Label(font_name='Osaka-Mono', font_size=18, color=(0, 0, 128, 255), 
+                                x=window.width - 10, y=window.height - 5, anchor_x='right', anchor_y='top')
+profile_label = pyglet.text.Label(font_name='Osaka-Mono', font_size=12, color=(0, 0, 128, 255), 
+                                  x=200, y=window.height - 5, anchor_y='top', multiline=True, width=400)
 death_count_label = pyglet.text.Label(font_name='Osaka-Mono', font_size=18, color=(0, 0, 128, 255), 
                                        x=10, y=window.height - 65, anchor_y='top')
 
+def speed_text():
+    text = 'Speed: max' if SPEEDS[speed_index] is None else f'Speed: {SPEEDS[speed_index]}x'
+    return text + ' (early cutoff)' if cutoff is not None else text
+
+speed_label.text = speed_text()
+
 ##### Key handling #####
 
 key_handler = key.KeyStateHandler()
@@ -84,6 +127,54 @@ def pressed(key):
     previously_pressed[key] = key_handler[key]
     return new_press
     
+##### Car drawing #####
+
+def add_car_renderer():
+    global car_renderer
+    car_renderer = CarRenderer(population.size + 2, car_batch)
+    update_car_renderer()
+
+def set_parents(parents):
+    '''Shows the cars of parents (as saved in saved/parents.json) as ghosts.
+    '''
+
+    global parents_shown
+    for i, parent in enumerate((parents['parent1'], parents['parent2'])):
+        parent_poses[i] = parent['x'], parent['y'], np.radians(parent['angle'])
+    parents_shown = True
+
+def update_car_renderer():
+    states = np.where(population.dead, CarRenderer.DEAD, CarRenderer.ALIVE)
+    shown = np.ones(population.size + 2, bool)
+    shown[-2:] = parents_shown
+
+    if DRAW_TOP[draw_top_index] is not None:
+        # Dead cars' fitness is final, and live cars get the fitness they would have if they died now
+        fitness = np.where(population.dead, population.fitness, population.get_fitness(np.arange(population.size)))
+        shown[:-2] = False
+        shown[np.argsort(fitness)[-DRAW_TOP[draw_top_index]:]] = True
+
+    car_renderer.update(np.concatenate((population.pos, parent_poses[:, :2])),
+                        np.concatenate((population.angle, parent_poses[:, 2])),
+                        np.concatenate((states, [CarRenderer.GHOST] * 2)), shown)
+
+def load_replay(replay_generation):
+    global replay, replay_time, replay_renderer
+    replay = Trajectories.load(os.path.join(TRAJECTORY_DIR, f'{replay_generation}.npz'))
+    replay_time = 0
+
+    if replay_renderer is not None:
+        replay_renderer.delete()
+    replay_renderer = CarRenderer(len(replay.poses), car_batch)
+
+    gen_label.text = f'Gen {replay.generation} (replay)'
+    best_fitness_label.text = f'Best fitness: {replay.fitness[0]:.3f}'
+    update_replay(0)
+
+def update_replay(tick):
+    states = np.where(tick >= replay.deaths, CarRenderer.DEAD, CarRenderer.ALIVE)
+    replay_renderer.update(replay.poses[:, tick, :2], replay.poses[:, tick, 2], states)
+
 ##### Main loop #####
 
 @window.event
@@ -99,14 +190,22 @@ def on_draw():
 
     if showing_menu:
         menu_layout.draw()
-    elif len(cars) > 0:
+    elif population is not None:
         gen_label.draw()
+        speed_label.draw()
+        if population.profiler.enabled:
+            profile_label.draw()
         best_fitness_label.draw()
         mean_fitness_label.draw()
+    elif replay is not None:
+        gen_label.draw()
+        speed_label.draw()
+        best_fitness_label.draw()
 
 def update(dt):
-    global menu_index, current_menu, showing_menu
-    global generation, blind, training, cars, train_time
+    global menu_index, current_menu, showing_menu, wall_segments, wall_tree
+    global blind, training, population, train_time, sim_time, speed_index, cutoff
+    global recorder, replay_time, draw_top_index
     
     # Scroll and select menus
     if showing_menu:
@@ -124,15 +223,10 @@ def update(dt):
         if pressed(key.RETURN):
             if current_menu == NEW_OR_LOAD:
                 if menu_index == 1:
-                    with open('saved/track') as f:
-                        for line in f:
-                            if not line.isspace():
-                                vals = np.array(line.split(), float)
-
-                                for x, y, x2, y2 in zip(vals[:-2:2], vals[1:-1:2], vals[2::2], vals[3::2]):
-                                    walls.append(pyglet.shapes.Line(x, y, x2, y2, 5, (128, 128, 128), wall_batch))
-                                    wall_tree.add_leaf(wall_tree.get_bounding_box([[x, y], [x2, y2]]), 
-                                                       walls[-1])
+                    track = load_compiled_track('saved/track')
+                    wall_segments, wall_tree = track.walls, track.wall_tree
+                    for x, y, x2, y2 in wall_segments:
+                        walls.append(pyglet.shapes.Line(x, y, x2, y2, 5, (128, 128, 128), wall_batch))
 
                     showing_menu = False
                     menu_index = 0
@@ -148,32 +242,58 @@ def update(dt):
                         with open('saved/parents.json') as f:
                             parents = json.load(f)
                             parent_hyperparams = parents['parent1']['hyperparams'], parents['parent2']['hyperparams']
-                            parent_car1.update(parents['parent1']['x'], parents['parent1']['y'], parents['parent1']['angle'])
-                            parent_car1.visible = True
-                            parent_car2.update(parents['parent2']['x'], parents['parent2']['y'], parents['parent2']['angle'])
-                            parent_car2.visible = True
-                    except:
+                            set_parents(parents)
+                    except FileNotFoundError:
                         parent_hyperparams = None
 
-                    for _ in range(500):
-                        cars.append(Car(start_car.x, start_car.y, 
-                                        np.radians(start_car.rotation), 
-                                        car_batch, parent_hyperparams))
+                    population = Population(start_car.x, start_car.y, np.radians(start_car.rotation),
+                                            500, parent_hyperparams)
+                    add_car_renderer()
+                    recorder = TrajectoryRecorder(population.size)
+                    recorder.reset(population)
                 elif menu_index == 1:
                     training = False
                     try:
                         with open('saved/parents.json') as f:
                             parents = json.load(f)
-                            for p in parents:
-                                cars.append(Car(start_car.x, start_car.y, 
-                                                np.radians(start_car.rotation), car_batch, 
-                                                parents[p]['hyperparams'], False))
+                            population = Population(start_car.x, start_car.y, np.radians(start_car.rotation),
+                                                    len(parents))
+                            for car, p in enumerate(parents):
+                                population.brain.set_flattened_hyperparams(car, *parents[p]['hyperparams'])
+                        add_car_renderer()
                         showing_menu = False
                         start_car.visible = False
                         gen_label.text = f'Gen {generation - 1}'
-                    except:
+                    except FileNotFoundError:
                         pass
-    elif len(cars) == 0:
+                elif menu_index == 3:
+                    if os.path.isdir(TRAJECTORY_DIR):
+                        replay_generations[:] = sorted(int(name[:-4]) for name in os.listdir(TRAJECTORY_DIR)
+                                                       if name.endswith('.npz'))
+                    if len(replay_generations) > 0:
+                        load_replay(replay_generations[-1])
+                        showing_menu = False
+                        start_car.visible = False
+    elif replay is not None:
+        # Left and right go through the saved generations
+        index = replay_generations.index(replay.generation)
+        if pressed(key.LEFT) and index > 0:
+            load_replay(replay_generations[index - 1])
+        if pressed(key.RIGHT) and index < len(replay_generations) - 1:
+            load_replay(replay_generations[index + 1])
+
+        if pressed(key.F):
+            speed_index = (speed_index + 1) % len(SPEEDS)
+            speed_label.text = speed_text()
+
+        # Poses are only looked up, so max speed is just fast
+        replay_time += dt * (SPEEDS[speed_index] or 30)
+        ticks = replay.poses.shape[1]
+        # Loop, pausing a second at the end
+        if replay_time >= ticks * replay.dt + 1:
+            replay_time = 0
+        update_replay(min(int(replay_time / replay.dt), ticks - 1))
+    elif population is None:
         # Move starting car
         if generation == 1:
             if key_handler[key.W]:
@@ -192,86 +312,124 @@ def update(dt):
         if pressed(key.RETURN) or generation > 1:
             showing_menu = True
             current_menu = TRAIN_OR_RUN
-            menu_doc.text = '> Train\n  Run saved parents\n  Manual control'
+            menu_doc.text = '> Train\n  Run saved parents\n  Manual control\n  Replay best cars'
     else:
-        # Constant delta time so fluctuations in framerate do not affect car.
-        # This is evident when the same generation loops yet course of cars are different.
-        dt = 0.02
-
-        live_cars = []
-        car_points = []
-        car_bbs = []
-        sensor_points = []
-        sensor_bbs = []
-
-        for car in cars:
-            if not car.dead:
-                live_cars.append(car)
-                car_points.append(wall_points := car.get_wall_points())
-                car_bbs.append(wall_tree.get_bounding_box(wall_points))
-                sensor_points.append(sensors := car.get_sensor_points())
-                sensor_bbs.append(wall_tree.get_bounding_box(sensors + [car.pos]))
-
-        car_collisions = wall_tree.query(car_bbs)
-        sensor_collisions = wall_tree.query(sensor_bbs)
-
-        for i in range(len(live_cars)):
-            live_cars[i].update(dt, car_collisions[i], car_points[i], sensor_collisions[i], sensor_points[i])
-        
-        if training:
-            train_time += dt
-        
         if pressed(key.B):
             blind = not blind
 
-        if (pressed(key.K) and not blind) or train_time >= 60:
-            train_time = 0
-            for car in cars:
-                car.kill()
-
-        # Reset everything if all cars are dead
-        if all([car.dead for car in cars]):
-            if training:
-                # Get hyperparameters of two cars with greatest fitness (parents)
-                bests = sorted(cars, key=lambda car: car.fitness)[-2:]
-
-                best_fitness_label.text = f'Previous best fitness: {bests[1].fitness:.3f}'
-                mean_fitness_label.text = f'Previous mean fitness: {sum(car.fitness for car in cars) / len(cars):.3f}'
-
-                save = {'parent1': {'x': bests[0].pos[0], 'y':bests[0].pos[1], 'angle': np.degrees(bests[0].angle), 
-                                    'hyperparams': bests[0].brain.get_flattened_hyperparams()}, 
-                        'parent2': {'x': bests[1].pos[0], 'y':bests[1].pos[1], 'angle': np.degrees(bests[1].angle), 
-                                    'hyperparams': bests[1].brain.get_flattened_hyperparams()}}
-
-                parent_car1.update(x=save['parent1']['x'], y=save['parent1']['y'], rotation=save['parent1']['angle'])
-                parent_car1.visible = True
-                parent_car2.update(x=save['parent2']['x'], y=save['parent2']['y'], rotation=save['parent2']['angle'])
-                parent_car2.visible = True
-
-                for car in cars:
-                    car.evolve(save['parent1']['hyperparams'], save['parent2']['hyperparams'])
-                    car.reset()
-                
-                with open('saved/parents.json', 'w') as f:
-                    json.dump(save, f)
-
-                generation += 1
-                gen_label.text = f'Gen {generation}'
-                with open('saved/setup.json', 'w') as f:
-                    json.dump({'generation': generation, 'x': start_car.x, 
-                            'y': start_car.y, 'angle': start_car.rotation}, f)
+        if pressed(key.N):
+            draw_top_index = (draw_top_index + 1) % len(DRAW_TOP)
+
+        # Profile each tick and show the summary of the last generation
+        if pressed(key.P):
+            if population.profiler.enabled:
+                population.profiler = NullProfiler()
             else:
-                for car in cars:
-                    car.reset()
-        
-        if blind:
-            deaths = 0
-            for car in cars:
-                if car.dead:
-                    deaths += 1
+                population.profiler = Profiler('saved/profile.jsonl')
+                profile_label.text = population.profiler.overlay_text()
+
+        if pressed(key.C):
+            if cutoff is None:
+                cutoff = EarlyCutoff()
+                cutoff.reset(population)
+            else:
+                cutoff = None
+            speed_label.text = speed_text()
+
+        if pressed(key.F):
+            speed_index = (speed_index + 1) % len(SPEEDS)
+            speed_label.text = speed_text()
+
+        if pressed(key.K) and not blind:
+            train_time = 0
+            population.kill()
+
+        # Run as many fixed steps as the real time passed (times the speed) allows,
+        # or as many as fit in one frame at max speed.
+        # Time that does not fit in a frame is dropped, so a slow machine runs slower instead of falling behind
+        deadline = time.perf_counter() + MAX_FRAME_STEP_TIME
+        if SPEEDS[speed_index] is None:
+            sim_time = 0
+            while time.perf_counter() < deadline:
+                step()
+        else:
+            sim_time += dt * SPEEDS[speed_index]
+            while sim_time >= SIM_DT:
+                if time.perf_counter() >= deadline:
+                    sim_time = 0
+                    break
+                sim_time -= SIM_DT
+                step()
+
+        # Cars are only drawn once per frame, however many steps were run
+        if not blind:
+            with population.profiler.phase('drawing'):
+                update_car_renderer()
+        else:
+            deaths = population.size - len(population.live())
+            death_count_label.text = f'{deaths} out of {population.size} dead'
+
+def step():
+    '''Advances the simulation by one fixed step of SIM_DT, breeding (or resetting) the population
+    once every car is dead.
+    '''
+
+    global generation, train_time
+
+    population.update(SIM_DT, wall_segments, wall_tree)
+    if recorder is not None:
+        recorder.record(population)
+
+    if training:
+        train_time += SIM_DT
+
+    if train_time >= 60 or (training and cutoff is not None and cutoff.update(population, train_time, 60, SIM_DT)):
+        train_time = 0
+        population.kill()
+
+    # Reset everything if all cars are dead
+    if not population.all_dead():
+        return
+
+    if training:
+        if population.profiler.enabled:
+            population.profiler.end_generation(generation)
+            profile_label.text = population.profiler.overlay_text()
+
+        # Get hyperparameters of two cars with greatest fitness (parents)
+        save = get_parents(population)
+
+        best_fitness_label.text = f'Previous best fitness: {population.fitness.max():.3f}'
+        mean_fitness_label.text = f'Previous mean fitness: {population.fitness.mean():.3f}'
+
+        set_parents(save)
+
+        # Before the population is reset
+        os.makedirs(TRAJECTORY_DIR, exist_ok=True)
+        writer.submit(os.path.join(TRAJECTORY_DIR, f'{generation}.npz'),
+                      recorder.best(population, 2, SIM_DT, generation).write)
+
+        population.evolve(save['parent1']['hyperparams'], save['parent2']['hyperparams'])
+        population.reset()
+
+        writer.submit('saved/parents.json', json_writer(save))
+
+        generation += 1
+        gen_label.text = f'Gen {generation}'
+        writer.submit('saved/setup.json', json_writer({'generation': generation, 'x': start_car.x,
+                                                       'y': start_car.y, 'angle': start_car.rotation}))
+    else:
+        population.reset()
 
-            death_count_label.text = f'{deaths} out of {len(cars)} dead'
+    if cutoff is not None:
+        cutoff.reset(population)
+    if recorder is not None:
+        recorder.reset(population)
 
 if __name__ == "__main__":
     pyglet.clock.schedule_interval(update, 1/120)
-    pyglet.app.run()
\ No newline at end of file
+    try:
+        pyglet.app.run()
+    finally:
+        # Write whatever is still waiting to be saved
+        writer.close()
\ No newline at end of file
@@ -1,3 +1,11 @@
-from racing.car import Car
+from racing.population import Population
 from racing.aabb_tree import AABBTree
-import racing.res
\ No newline at end of file
+from racing.bvh import BVH
+
+def __getattr__(name):
+    # Car needs pyglet (and a window for its sprite), so it is only imported when used.
+    # This keeps headless training (racing.train) free of pyglet.
+    if name == 'Car':
+        from racing.car import Car
+        return Car
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -53,21 +53,24 @@ class AABBTree:
         return bb1[2] > bb2[0] and bb1[0] < bb2[2] and bb1[3] > bb2[1] and bb1[1] < bb2[3]
 
     def query(self, bounding_boxes):
-        stack = [self.tree]
         collisions = [[] for _ in bounding_boxes]
+        # Each item is a node and the boxes (indices into bounding_boxes) that intersect its parent,
+        # so every box only descends into the subtrees it intersects
+        stack = [(self.tree, range(len(bounding_boxes)))]
 
         while len(stack) > 0:
-            node = stack.pop()
-            for bb in range(len(bounding_boxes)):
-                if self.intersects(node['bb'], bounding_boxes[bb]):
-                    if 'reference' in node:
-                        collisions[bb].append(node['reference'])
-                    else:
-                        stack.append(node['children'][0])
-                        # This will only be False when the tree has one leaf node
-                        if len(node['children']) > 1:
-                            stack.append(node['children'][1])
-                        break
+            node, boxes = stack.pop()
+            boxes = [bb for bb in boxes if self.intersects(node['bb'], bounding_boxes[bb])]
+
+            if len(boxes) == 0:
+                continue
+            elif 'reference' in node:
+                for bb in boxes:
+                    collisions[bb].append(node['reference'])
+            else:
+                # This will only have one child when the tree has one leaf node
+                for child in node['children']:
+                    stack.append((child, boxes))
 
         return collisions
     
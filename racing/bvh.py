@@ -0,0 +1,238 @@
+import numpy as np
+
+from racing import collision
+
+class BVH:
+    '''Static bounding volume hierarchy over walls, bulk built top-down with the
+    surface area heuristic (perimeter, as this is 2D) into flat arrays.
+    Unlike AABBTree, it is built once from every wall, so its shape does not
+    depend on the order walls are listed in.
+
+    Node i has bounding box node_bbs[i] (minx, miny, maxx, maxy) and children children[i].
+    Leaf nodes have children [-1, -1] and hold walls wall_order[leaf_start[i]:leaf_start[i] + leaf_count[i]].
+    Node 0 is the root.
+    '''
+
+    def __init__(self, walls, leaf_size=4):
+        '''walls is an array of shape (K, 4), each row being x, y, x2, y2.
+        '''
+
+        self.walls = walls = np.asarray(walls, float).reshape(-1, 4)
+        self.wall_bbs = np.column_stack((np.minimum(walls[:, 0], walls[:, 2]), np.minimum(walls[:, 1], walls[:, 3]),
+                                         np.maximum(walls[:, 0], walls[:, 2]), np.maximum(walls[:, 1], walls[:, 3])))
+
+        node_bbs = []
+        children = []
+        leaf_start = []
+        leaf_count = []
+        wall_order = []
+
+        centroids = (self.wall_bbs[:, :2] + self.wall_bbs[:, 2:]) / 2
+        # Each item is (walls under node, index of parent, which child of the parent)
+        stack = [(np.arange(len(walls)), -1, 0)] if len(walls) > 0 else []
+
+        while len(stack) > 0:
+            indices, parent, side = stack.pop()
+            node = len(node_bbs)
+            if parent >= 0:
+                children[parent][side] = node
+
+            bbs = self.wall_bbs[indices]
+            node_bbs.append((*bbs[:, :2].min(axis=0), *bbs[:, 2:].max(axis=0)))
+            children.append([-1, -1])
+
+            if len(indices) <= leaf_size:
+                leaf_start.append(len(wall_order))
+                leaf_count.append(len(indices))
+                wall_order.extend(indices)
+            else:
+                left, right = self.split(indices, centroids)
+                leaf_start.append(0)
+                leaf_count.append(0)
+                # Push right first so that nodes are laid out in depth first order
+                stack.append((right, node, 1))
+                stack.append((left, node, 0))
+
+        self.node_bbs = np.array(node_bbs, float).reshape(-1, 4)
+        self.children = np.array(children, int).reshape(-1, 2)
+        self.leaf_start = np.array(leaf_start, int)
+        self.leaf_count = np.array(leaf_count, int)
+        self.wall_order = np.array(wall_order, int)
+        self.ordered_walls = self.walls[self.wall_order]
+
+    # Everything a built tree is made of, for saving and loading it (see racing.compiled_track)
+    arrays = ('walls', 'wall_bbs', 'node_bbs', 'children', 'leaf_start', 'leaf_count', 'wall_order', 'ordered_walls')
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''Returns the tree made of arrays (a dict with every name in BVH.arrays), without building it again.
+        '''
+
+        tree = cls.__new__(cls)
+        for name in cls.arrays:
+            setattr(tree, name, arrays[name])
+
+        return tree
+
+    def split(self, indices, centroids):
+        '''Returns the split of indices into two halves with the lowest cost,
+        trying every split position along both axes.
+        '''
+
+        best_cost = np.inf
+        best = None
+
+        for axis in range(2):
+            ordered = indices[np.argsort(centroids[indices, axis], kind='stable')]
+            bbs = self.wall_bbs[ordered]
+
+            # Half perimeters of the boxes around the first i + 1 and the last n - i - 1 walls
+            left = self.half_perimeter(np.minimum.accumulate(bbs[:, :2]), np.maximum.accumulate(bbs[:, 2:]))
+            right = self.half_perimeter(np.minimum.accumulate(bbs[::-1, :2])[::-1],
+                                        np.maximum.accumulate(bbs[::-1, 2:])[::-1])
+
+            counts = np.arange(1, len(ordered))
+            costs = left[:-1] * counts + right[1:] * counts[::-1]
+            i = np.argmin(costs)
+
+            if costs[i] < best_cost:
+                best_cost = costs[i]
+                best = ordered[:i + 1], ordered[i + 1:]
+
+        return best
+
+    @staticmethod
+    def half_perimeter(mins, maxs):
+        return (maxs[:, 0] - mins[:, 0]) + (maxs[:, 1] - mins[:, 1])
+
+    @staticmethod
+    def intersects(bbs1, bbs2):
+        '''Vectorized AABBTree.intersects().
+        '''
+
+        return ((bbs1[:, 2] > bbs2[:, 0]) & (bbs1[:, 0] < bbs2[:, 2])
+                & (bbs1[:, 3] > bbs2[:, 1]) & (bbs1[:, 1] < bbs2[:, 3]))
+
+    @staticmethod
+    def get_bounding_boxes(points):
+        '''Returns the bounding boxes (of shape (N, 4)) of N sets of points (of shape (N, P, 2)).
+        '''
+
+        return np.concatenate((points.min(axis=1), points.max(axis=1)), axis=1)
+
+    def query(self, bounding_boxes):
+        '''Finds the walls whose bounding boxes intersect each of the given bounding boxes (of shape (M, 4)).
+        Returns (offsets, walls), where box i intersects walls[offsets[i]:offsets[i + 1]] (indices into the walls
+        the tree was built from, in increasing order).
+        '''
+
+        bounding_boxes = np.asarray(bounding_boxes, float).reshape(-1, 4)
+        found_boxes = []
+        found_walls = []
+
+        # Every (box, node) pair still to visit, starting from the root
+        boxes = np.arange(len(bounding_boxes)) if len(self.node_bbs) > 0 else np.zeros(0, int)
+        nodes = np.zeros(len(boxes), int)
+
+        while len(boxes) > 0:
+            hit = self.intersects(self.node_bbs[nodes], bounding_boxes[boxes])
+            boxes, nodes = boxes[hit], nodes[hit]
+
+            leaf = self.children[nodes, 0] < 0
+            counts = self.leaf_count[nodes[leaf]]
+            starts = self.leaf_start[nodes[leaf]]
+            leaf_boxes = np.repeat(boxes[leaf], counts)
+            walls = self.wall_order[np.arange(counts.sum()) + np.repeat(starts - np.cumsum(counts) + counts, counts)]
+
+            # Leaf bounding boxes cover several walls, so check each wall on its own
+            hit = self.intersects(self.wall_bbs[walls], bounding_boxes[leaf_boxes])
+            found_boxes.append(leaf_boxes[hit])
+            found_walls.append(walls[hit])
+
+            boxes = np.repeat(boxes[~leaf], 2)
+            nodes = self.children[nodes[~leaf]].ravel()
+
+        found_boxes = np.concatenate(found_boxes) if found_boxes else np.zeros(0, int)
+        found_walls = np.concatenate(found_walls) if found_walls else np.zeros(0, int)
+        order = np.lexsort((found_walls, found_boxes))
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(found_boxes, minlength=len(bounding_boxes)))))
+
+        return offsets, found_walls[order]
+
+    @staticmethod
+    def entry_distances(bbs, starts, inverse_directions):
+        '''Returns the fraction of the way along each ray (starts + t * directions, 0 <= t <= 1)
+        at which it enters each bounding box, or inf if it misses.
+        Boxes are grown by a tiny amount so that rays grazing an edge are never missed.
+        '''
+
+        # For rays parallel to an axis, these are -inf and inf if the ray lies between the box's sides,
+        # or both inf or both -inf if it does not
+        with np.errstate(invalid='ignore'):
+            tx1 = (bbs[:, 0] - 1e-7 - starts[:, 0]) * inverse_directions[:, 0]
+            tx2 = (bbs[:, 2] + 1e-7 - starts[:, 0]) * inverse_directions[:, 0]
+            ty1 = (bbs[:, 1] - 1e-7 - starts[:, 1]) * inverse_directions[:, 1]
+            ty2 = (bbs[:, 3] + 1e-7 - starts[:, 1]) * inverse_directions[:, 1]
+
+        entry = np.maximum(np.maximum(np.fmin(tx1, tx2), np.fmin(ty1, ty2)), 0)
+        exit = np.minimum(np.minimum(np.fmax(tx1, tx2), np.fmax(ty1, ty2)), 1)
+        return np.where(entry <= exit, entry, np.inf)
+
+    def raycast(self, starts, ends):
+        '''Casts rays from starts to ends (both of shape (M, 2)) through the tree and returns the distance
+        from each start to its nearest wall (as collision.intersection_distances() would), or inf if nothing is hit.
+
+        Every ray goes down the tree a level at a time (so all rays move in one batch), and nodes are only visited
+        while they could hold a hit closer than the nearest one found at the levels above. This prunes little
+        when the walls near each ray are few, where testing each ray against every wall of a box query is faster
+        (see walls_near()).
+        '''
+
+        starts = np.asarray(starts, float).reshape(-1, 2)
+        ends = np.asarray(ends, float).reshape(-1, 2)
+        directions = ends - starts
+        lengths = np.sqrt((directions**2).sum(axis=1))
+        with np.errstate(divide='ignore'):
+            inverse_directions = 1 / directions
+        nearest = np.full(len(starts), np.inf)
+
+        # Every (ray, node) pair still to visit, with the distance at which the ray enters the node
+        rays = np.arange(len(starts)) if len(self.node_bbs) > 0 else np.zeros(0, int)
+        nodes = np.zeros(len(rays), int)
+        entry = np.zeros(len(rays))
+
+        while len(rays) > 0:
+            closer = entry < nearest[rays]
+            rays, nodes = rays[closer], nodes[closer]
+
+            leaf = self.children[nodes, 0] < 0
+            if leaf.any():
+                counts = self.leaf_count[nodes[leaf]]
+                leaf_starts = self.leaf_start[nodes[leaf]]
+                leaf_rays = np.repeat(rays[leaf], counts)
+                walls = self.ordered_walls[np.arange(len(leaf_rays))
+                                           + np.repeat(leaf_starts - np.cumsum(counts) + counts, counts)]
+
+                distances = collision.intersection_distances(starts[leaf_rays], ends[leaf_rays],
+                                                             walls[:, :2], walls[:, 2:])
+                np.minimum.at(nearest, leaf_rays, distances)
+
+            rays = np.repeat(rays[~leaf], 2)
+            nodes = self.children[nodes[~leaf]].ravel()
+            entry = self.entry_distances(self.node_bbs[nodes], starts[rays], inverse_directions[rays]) * lengths[rays]
+
+        return nearest
+
+    def walls_near(self, radius, samples=64):
+        '''Returns the mean number of walls whose bounding boxes come within radius (in x and y)
+        of the middle of a wall, over up to samples walls spread across the track.
+        A measure of how cluttered the track is around things driving along it.
+        '''
+
+        if len(self.walls) == 0:
+            return 0
+
+        middles = (self.walls[:, :2] + self.walls[:, 2:]) / 2
+        middles = middles[np.linspace(0, len(middles) - 1, min(len(middles), samples)).astype(int)]
+        offsets, _ = self.query(np.concatenate((middles - radius, middles + radius), axis=1))
+        return offsets[-1] / len(middles)
@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+
+from racing.population import Population
+from racing.saving import atomic_write
+
+class Checkpoint:
+    '''Everything needed to resume training exactly: the genomes of the generation about to be simulated,
+    the state of the Breeder's random number generator, the generation number, the starting pose, 
+    the hash of the track being trained on and the stats of every finished generation 
+    (rows of generation, best fitness, mean fitness).
+    '''
+
+    def __init__(self, genomes, generation, x, y, angle, rng_state=None, track_hash=None, stats=None):
+        genomes = np.asarray(genomes)
+        # Kept as float32 if they are (see Population's dtype)
+        self.genomes = genomes if genomes.dtype == np.float32 else genomes.astype(float)
+        self.generation = generation
+        self.x, self.y, self.angle = x, y, angle  # angle is in degrees, like saved/setup.json
+        self.rng_state = rng_state
+        self.track_hash = track_hash
+        self.stats = np.zeros((0, 3)) if stats is None else np.asarray(stats, float).reshape(-1, 3)
+
+    def save(self, path):
+        '''Writes the checkpoint as an .npz file. The file is written next to path first
+        and then renamed, so a crash never leaves a half written checkpoint behind.
+        '''
+
+        atomic_write(path, self.write)
+
+    def write(self, f):
+        header = {'generation': self.generation, 'x': self.x, 'y': self.y, 'angle': self.angle,
+                  'rng_state': self.rng_state, 'track_hash': self.track_hash}
+        np.savez(f, genomes=self.genomes, stats=self.stats, header=json.dumps(header))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            header = json.loads(str(data['header']))
+            return cls(data['genomes'], header['generation'], header['x'], header['y'], header['angle'],
+                       header['rng_state'], header['track_hash'], data['stats'])
+
+    @classmethod
+    def from_json(cls, setup_path, parents_path, size, breeder, dtype=float):
+        '''Imports the saved/setup.json and saved/parents.json written by racing.py.
+        As only the two parents are saved there, a population of size is bred from them with breeder
+        (or is random if there are no parents yet), with genomes of type dtype.
+        '''
+
+        # Same defaults as the starting car in racing.py
+        setup = {'generation': 1, 'x': 650, 'y': 400, 'angle': 0}
+        try:
+            with open(setup_path) as f:
+                setup = json.load(f)
+        except FileNotFoundError:
+            print(f'{setup_path} not found, starting at generation 1 in the middle of the window')
+
+        try:
+            with open(parents_path) as f:
+                parents = json.load(f)
+                parent_hyperparams = parents['parent1']['hyperparams'], parents['parent2']['hyperparams']
+        except FileNotFoundError:
+            parent_hyperparams = None
+
+        population = Population(setup['x'], setup['y'], np.radians(setup['angle']), size, parent_hyperparams,
+                                breeder=breeder, dtype=dtype)
+
+        return cls(population.brain.get_genomes(), setup['generation'], setup['x'], setup['y'], setup['angle'],
+                   breeder.rng.bit_generator.state)
@@ -65,4 +65,108 @@ def get_intersection(p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, p4: np.ndar
         return p1 + (m1 * d1)
     # Line segments are not parallel and do not intersect
     else:
-        return None
\ No newline at end of file
+        return None
+
+#### Vectorized collision detection functions ####
+# Points are arrays of shape (..., 2) that broadcast against each other,
+# so many pairs of line segments can be tested in one call.
+
+def orientations(p1, p2, p3):
+    '''Vectorized orientation(). Returns an array of 1, -1 and 0.
+    '''
+
+    ccw = (p3[..., 1] - p1[..., 1]) * (p2[..., 0] - p1[..., 0]) - (p2[..., 1] - p1[..., 1]) * (p3[..., 0] - p1[..., 0])
+    return np.sign(ccw)
+
+def segments_intersecting(p1, p2, p3, p4):
+    '''Vectorized intersecting(). Returns a boolean array that is True 
+    where line segment p1p2 intersects line segment p3p4.
+    '''
+
+    return ((orientations(p1, p3, p4) != orientations(p2, p3, p4)) 
+            & (orientations(p1, p2, p3) != orientations(p1, p2, p4)))
+
+def intersection_distances(p1, p2, p3, p4):
+    '''Vectorized get_intersection(). Returns the distance from p1 to the point
+    get_intersection() would return, or inf where it would return None.
+    '''
+
+    cross = lambda a, b: a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+    dot = lambda a, b: a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1]
+
+    d1 = p2 - p1
+    d2 = p4 - p3
+
+    dc = cross(d1, d2)
+    pd = p3 - p1
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m1 = cross(pd, d2) / dc
+        m2 = cross(pd, d1) / dc
+
+        # Line segments are not parallel and intersect
+        crossing = (dc != 0) & (0 <= m1) & (m1 <= 1) & (0 <= m2) & (m2 <= 1)
+        distances = np.where(crossing, m1 * np.sqrt(dot(d1, d1)), np.inf)
+
+        # Line segments are collinear (and so also parallel)
+        d1_sq = dot(d1, d1)
+        t1 = dot(pd, d1) / d1_sq
+        t2 = t1 + (p := dot(d1, d2)) / d1_sq
+        overlapping = np.where(p < 0, (t2 <= 1) & (0 <= t1), (t1 <= 1) & (0 <= t2))
+        collinear = (dc == 0) & (cross(pd, d1) == 0) & overlapping
+
+    # The endpoint of the second line segment that is closest to p1
+    closest = np.minimum(np.sqrt(dot(pd, pd)), np.sqrt(dot(p4 - p1, p4 - p1)))
+
+    return np.where(collinear, closest, distances)
+
+def any_intersecting(starts, ends, walls):
+    '''Tests M line segments (starts and ends are of shape (M, 2)) against 
+    K walls (of shape (K, 4), each being x, y, x2, y2). 
+    Returns a boolean array of shape (M,) that is True where a segment hits any wall.
+    '''
+
+    hits = segments_intersecting(starts[:, None], ends[:, None], walls[None, :, :2], walls[None, :, 2:])
+    return hits.any(axis=1)
+
+def nearest_intersections(starts, ends, walls):
+    '''Casts M rays (from starts to ends, both of shape (M, 2)) against 
+    K walls (of shape (K, 4), each being x, y, x2, y2).
+    Returns an array of shape (M,) of distances from each start to its nearest hit, inf if nothing is hit.
+    '''
+
+    distances = intersection_distances(starts[:, None], ends[:, None], walls[None, :, :2], walls[None, :, 2:])
+    return distances.min(axis=1, initial=np.inf)
+
+def sweep_times(a0, b0, a1, b1, points):
+    '''Returns the earliest t (0 <= t <= 1) at which the line segment from a0 + t * (a1 - a0) to b0 + t * (b1 - b0)
+    passes through each point, or inf where it does not, i.e. where the point is outside the quadrilateral
+    swept by line segment a0b0 moving to a1b1 (with its endpoints moving in straight lines).
+    '''
+
+    cross = lambda a, b: a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+    dot = lambda a, b: a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1]
+
+    # The segment is u(t) = u0 + t * du from a(t) = a0 + t * da, and the point is at v(t) = v0 - t * da from a(t).
+    # It is on the segment's line where cross(u(t), v(t)) = c0 + c1 * t + c2 * t^2 = 0
+    da = a1 - a0
+    u0 = b0 - a0
+    du = b1 - b0 - da
+    v0 = points - a0
+    c0 = cross(u0, v0)
+    c1 = cross(du, v0) - cross(u0, da)
+    c2 = -cross(du, da)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        discriminant = c1**2 - 4 * c2 * c0
+        # Numerically stable roots, which are also right (one being inf or nan) when c2 is 0 and this is linear
+        q = -0.5 * (c1 + np.where(c1 < 0, -1, 1) * np.sqrt(np.maximum(discriminant, 0)))
+        roots = np.stack((q / c2, c0 / q))
+
+        u = u0 + roots[..., None] * du
+        v = v0 - roots[..., None] * da
+        # Fraction of the way along the segment the point is at
+        s = dot(u, v) / dot(u, u)
+        valid = (discriminant >= 0) & (roots >= 0) & (roots <= 1) & (s >= 0) & (s <= 1)
+
+    return np.where(valid, roots, np.inf).min(axis=0)
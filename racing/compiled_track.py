@@ -0,0 +1,127 @@
+'''A compiled track is a single binary file holding a track's walls, its BVH and (optionally)
+its DistanceField, so that they are loaded without parsing or building anything.
+
+The file starts with MAGIC, the length of a JSON header (as a little endian uint32) and the header,
+which lists the dtype, shape and offset of every array. Arrays are stored raw and aligned,
+so they are memory mapped rather than read.
+'''
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from racing.bvh import BVH
+from racing.distance_field import DistanceField
+from racing.saving import atomic_write
+from racing.track import load_track
+
+MAGIC = b'RACETRK1'
+ALIGNMENT = 64
+
+def aligned(size):
+    # Rounds size up to a multiple of ALIGNMENT
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+class CompiledTrack:
+    '''The walls (of shape (K, 4)), BVH and distance field (or None) of a track,
+    and the hash of the text file they were compiled from.
+    '''
+
+    def __init__(self, walls, wall_tree, distance_field=None, source_hash=None):
+        self.walls = walls
+        self.wall_tree = wall_tree
+        self.distance_field = distance_field
+        self.source_hash = source_hash
+
+    @classmethod
+    def build(cls, walls, cell_size=None, source_hash=None):
+        walls = np.asarray(walls, float).reshape(-1, 4)
+        distance_field = DistanceField(walls, cell_size) if cell_size else None
+        return cls(walls, BVH(walls), distance_field, source_hash)
+
+    def save(self, path):
+        atomic_write(path, self.write)
+
+    def write(self, f):
+        arrays = {f'bvh.{name}': getattr(self.wall_tree, name) for name in BVH.arrays}
+        header = {'source_hash': self.source_hash, 'arrays': {}}
+        if self.distance_field is not None:
+            arrays['distance_field.grid'] = self.distance_field.grid
+            header['distance_field'] = {'cell_size': self.distance_field.cell_size,
+                                        'origin': [float(self.distance_field.x0), float(self.distance_field.y0)]}
+
+        # Offsets are relative to the end of the header, as its length depends on them
+        offset = 0
+        for name, array in arrays.items():
+            array = arrays[name] = np.ascontiguousarray(array)
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+            offset += aligned(array.nbytes)
+
+        offsets = {name: info['offset'] for name, info in header['arrays'].items()}
+        header = json.dumps(header).encode()
+        start = aligned(len(MAGIC) + 4 + len(header))
+
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(start + offsets[name])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+
+    @classmethod
+    def load(cls, path):
+        '''Memory maps a compiled track. Raises ValueError if path is not one.
+        '''
+
+        data = np.memmap(path, np.uint8, 'r')
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path} is not a compiled track')
+
+        header_length, = struct.unpack('<I', bytes(data[len(MAGIC):len(MAGIC) + 4]))
+        header = json.loads(bytes(data[len(MAGIC) + 4:len(MAGIC) + 4 + header_length]))
+        start = aligned(len(MAGIC) + 4 + header_length)
+
+        arrays = {}
+        for name, info in header['arrays'].items():
+            dtype = np.dtype(info['dtype'])
+            count = int(np.prod(info['shape'], dtype=int))
+            offset = start + info['offset']
+            arrays[name] = data[offset:offset + count * dtype.itemsize].view(dtype).reshape(info['shape'])
+
+        wall_tree = BVH.from_arrays({name: arrays[f'bvh.{name}'] for name in BVH.arrays})
+        distance_field = None
+        if 'distance_field' in header:
+            distance_field = DistanceField(None, header['distance_field']['cell_size'],
+                                           grid=arrays['distance_field.grid'],
+                                           origin=tuple(header['distance_field']['origin']))
+
+        return cls(wall_tree.walls, wall_tree, distance_field, header['source_hash'])
+
+def load_compiled_track(path, cell_size=None, cache_dir='saved/cache'):
+    '''Returns the CompiledTrack of the text track file at path (see racing.track.load_track()),
+    with a distance field of cell_size if given. The first time a track (with those contents) is loaded,
+    it is compiled into cache_dir, and it is only memory mapped from there afterwards.
+    '''
+
+    with open(path, 'rb') as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+
+    compiled_path = os.path.join(cache_dir, f'{source_hash}.track')
+    if os.path.exists(compiled_path):
+        try:
+            track = CompiledTrack.load(compiled_path)
+        except ValueError:
+            track = None
+
+        field = None if track is None else track.distance_field
+        # A distance field of another cell size needs compiling again
+        if (track is not None and track.source_hash == source_hash
+                and (not cell_size or (field is not None and field.cell_size == cell_size))):
+            return track
+
+    track = CompiledTrack.build(load_track(path), cell_size, source_hash)
+    os.makedirs(cache_dir, exist_ok=True)
+    track.save(compiled_path)
+    return track
@@ -0,0 +1,54 @@
+import numpy as np
+
+class EarlyCutoff:
+    '''Ends a generation early once no live car can beat the two best dead cars,
+    using Population.max_fitness(). The parents chosen are the same as if the generation ran to the end,
+    as dead cars' fitness never changes.
+
+    With stagnation (in seconds), cars whose total movement grew by less than min_progress
+    over the last stagnation seconds are also killed. Unlike the bound, this changes those cars' fitness.
+
+        cutoff.reset(population)
+        while ...:
+            population.update(dt, ...)
+            if cutoff.update(population, time, duration, dt):
+                break
+    '''
+
+    def __init__(self, stagnation=None, min_progress=20):
+        self.stagnation = stagnation
+        self.min_progress = min_progress
+
+    def reset(self, population):
+        '''Starts watching the current generation of population.
+        '''
+
+        self.live = population.live()
+        # Fitness of the two best dead cars (there may already be some if the generation has started)
+        self.best = np.sort(np.concatenate(([-np.inf, -np.inf], population.fitness[population.dead])))[-2:]
+        self.movement = population.total_movement.copy()
+        self.next_check = self.stagnation
+
+    def update(self, population, time, duration, dt):
+        '''Called after each update of population, time seconds into a generation of duration seconds.
+        Returns True if the generation can end now.
+        '''
+
+        if self.stagnation is not None and time >= self.next_check:
+            live = population.live()
+            population.kill(live[population.total_movement[live] - self.movement[live] < self.min_progress])
+            self.movement[:] = population.total_movement
+            self.next_check += self.stagnation
+
+        # Only the cars that died since the last update can change the best two
+        died = self.live[population.dead[self.live]]
+        self.live = population.live()
+        if len(died) > 0:
+            self.best = np.sort(np.concatenate((self.best, population.fitness[died])))[-2:]
+
+        if self.best[0] == -np.inf:
+            return False
+
+        # Allow for one more step than the time left, as time is a sum of floats
+        time_left = max(duration - time, 0) + dt
+        return bool((population.max_fitness(self.live, time_left, dt) < self.best[0]).all())
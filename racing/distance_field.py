@@ -0,0 +1,97 @@
+import numpy as np
+
+class DistanceField:
+    '''A grid over the track holding the distance from the center of each cell to the nearest wall.
+    Used to skip the exact collision test for cars that are clearly away from every wall:
+    a lookup gives a lower bound of the distance to the nearest wall anywhere in a cell.
+
+    Cell (i, j) has its center at (x0 + (j + 0.5) * cell_size, y0 + (i + 0.5) * cell_size).
+    '''
+
+    def __init__(self, walls, cell_size=4, padding=20, grid=None, origin=None):
+        '''Builds the field over the bounding box of walls (of shape (K, 4)) grown by padding on every side,
+        unless grid and origin (as stored in a compiled track, see racing.compiled_track) are given.
+        '''
+
+        self.cell_size = cell_size
+
+        if grid is not None:
+            self.grid = grid
+            self.x0, self.y0 = origin
+            return
+
+        walls = np.asarray(walls, float).reshape(-1, 4)
+
+        if len(walls) == 0:
+            self.grid = np.zeros((0, 0))
+            self.x0 = self.y0 = 0
+            return
+
+        points = walls.reshape(-1, 2)
+        self.x0, self.y0 = points.min(axis=0) - padding
+        columns, rows = np.ceil((points.max(axis=0) + padding - (self.x0, self.y0)) / cell_size).astype(int)
+
+        xs = self.x0 + (np.arange(columns) + 0.5) * cell_size
+        ys = self.y0 + (np.arange(rows) + 0.5) * cell_size
+        centers = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+
+        self.grid = np.full(len(centers), np.inf)
+        # Walls are done a chunk at a time to keep the (cells, walls) arrays small
+        chunk = max(1, 2**22 // len(centers))
+        for start in range(0, len(walls), chunk):
+            self.grid = np.minimum(self.grid, self.segment_distances(centers, walls[start:start + chunk]).min(axis=1))
+
+        self.grid = self.grid.reshape(rows, columns)
+
+    @staticmethod
+    def segment_distances(points, walls):
+        '''Returns the distance from every point (of shape (P, 2)) to every wall (of shape (K, 4)) as a (P, K) array.
+        '''
+
+        a = walls[None, :, :2]
+        d = walls[None, :, 2:] - a
+        pa = points[:, None] - a
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip((pa * d).sum(axis=2) / (d * d).sum(axis=2), 0, 1)
+        # Walls that are a single point
+        t = np.nan_to_num(t)
+
+        closest = pa - t[..., None] * d
+        return np.sqrt((closest * closest).sum(axis=2))
+
+    def lower_bounds(self, points):
+        '''Returns, for points of shape (..., 2), a distance no greater than the distance to the nearest wall.
+        Points outside the grid get their distance to it, as every wall is inside it.
+        '''
+
+        if self.grid.size == 0:
+            return np.full(points.shape[:-1], np.inf)
+
+        cells = np.floor((points - (self.x0, self.y0)) / self.cell_size).astype(int)
+        rows, columns = self.grid.shape
+        inside = (cells[..., 0] >= 0) & (cells[..., 0] < columns) & (cells[..., 1] >= 0) & (cells[..., 1] < rows)
+        distances = self.grid[np.clip(cells[..., 1], 0, rows - 1), np.clip(cells[..., 0], 0, columns - 1)]
+        # Any point in a cell is at most half a diagonal away from its center
+        outside = np.maximum(np.maximum((self.x0, self.y0) - points,
+                                        points - (self.x0 + columns * self.cell_size, self.y0 + rows * self.cell_size)), 0)
+        return np.where(inside, distances - self.cell_size * np.sqrt(2) / 2, np.sqrt((outside**2).sum(axis=-1)))
+
+    def clear(self, outlines, radius=0):
+        '''For outlines of shape (N, V, 2) (closed polylines such as Population.get_wall_points()),
+        returns a boolean array that is True where the outline certainly does not touch a wall.
+        With radius, every point within radius of the outline must not touch one either.
+        False means an exact test is needed.
+        '''
+
+        starts = outlines[:, :-1]
+        edges = outlines[:, 1:] - starts
+
+        # Sample each edge at most cell_size apart, so every point of it is within step / 2 of a sample
+        samples = int(np.ceil(np.sqrt((edges**2).sum(axis=2)).max(initial=0) / self.cell_size)) + 1
+        t = np.linspace(0, 1, samples)
+        points = starts[:, :, None] + t[:, None] * edges[:, :, None]
+        step = np.sqrt((edges**2).sum(axis=2)) / max(samples - 1, 1)
+
+        bounds = self.lower_bounds(points) - step[..., None] / 2 - radius
+        return bounds.min(axis=(1, 2)) > 1e-6
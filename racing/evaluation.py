@@ -0,0 +1,68 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from racing.bvh import BVH
+from racing.population import Population
+
+# Walls, BVH and distance field of the worker process, set once by _init_worker()
+_walls = None
+_wall_tree = None
+_distance_field = None
+
+def _init_worker(walls, distance_field, wall_tree):
+    global _walls, _wall_tree, _distance_field
+    _walls = walls
+    _wall_tree = wall_tree if wall_tree is not None else BVH(walls)
+    _distance_field = distance_field
+
+def _evaluate_shard(genomes, x, y, angle, duration, dt, cutoff, swept, dtype):
+    population = Population(x, y, angle, len(genomes), swept=swept, dtype=dtype)
+    population.brain.set_genomes(genomes)
+    finished = population.run_episode(_walls, _wall_tree, duration, dt, _distance_field, cutoff)
+
+    return population.fitness, np.column_stack((population.pos, population.angle)), finished
+
+class ParallelEvaluator:
+    '''Simulates a population by splitting it into shards across a pool of processes.
+    Every process keeps its own copy of the walls and their BVH, 
+    and genomes are sent as float arrays (see BatchedNeuralNetwork.get_genomes()).
+    '''
+
+    def __init__(self, walls, workers=None, distance_field=None, wall_tree=None):
+        '''If wall_tree (a BVH of walls) is given, it is sent to every process instead of being built in each.
+        '''
+
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, 
+                                        initargs=(np.asarray(walls, float), distance_field, wall_tree))
+
+    def evaluate(self, genomes, x, y, angle, duration=60, dt=0.02, cutoff=None, swept=False, dtype=float):
+        '''Simulates one episode for each genome (row of genomes) starting at x, y and angle (in radians),
+        which are either the same for every genome or arrays of one per genome.
+        Returns the fitness of each genome, the final pose of each car as [x, y, angle (in radians)]
+        and whether each result does not depend on the rest of the population (see Population.run_episode()).
+        A racing.cutoff.EarlyCutoff is applied to each shard on its own, which is still safe,
+        as a car that cannot beat the best two of its shard cannot beat the best two overall.
+        swept and dtype are passed on to Population.
+        '''
+
+        shards = [shard for shard in np.array_split(np.arange(len(genomes)), self.workers) if len(shard) > 0]
+        starts = [[np.broadcast_to(value, len(genomes))[shard] for shard in shards] for value in (x, y, angle)]
+        results = list(self.pool.map(_evaluate_shard, [genomes[shard] for shard in shards], *starts,
+                                     *[[arg] * len(shards) for arg in (duration, dt, cutoff, swept, dtype)]))
+
+        fitness = np.concatenate([f for f, _, _ in results])
+        poses = np.concatenate([p for _, p, _ in results])
+        finished = np.concatenate([d for _, _, d in results])
+        return fitness, poses, finished
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
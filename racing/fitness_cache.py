@@ -0,0 +1,92 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+class FitnessCache:
+    '''Fitness and final pose of genomes already simulated, so that identical individuals
+    (parents copied by elitism, children that were not changed by crossover or mutation, ...)
+    are not simulated again. The simulation is deterministic, so a genome simulated in the same
+    context (track, start pose, physics constants, dt, ...) always gets the same result.
+
+    Holds at most max_size genomes, dropping the least recently used.
+    '''
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def context(*values):
+        '''Returns a key for everything (besides the genome) that a result depends on.
+        '''
+
+        return hashlib.sha256(repr(values).encode()).digest()
+
+    @staticmethod
+    def key(genome, context):
+        return hashlib.sha256(np.ascontiguousarray(genome, float).tobytes()).digest() + context
+
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def get(self, key):
+        '''Returns (fitness, pose) of key, or None if it is not cached.
+        '''
+
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return result
+
+    def put(self, key, fitness, pose):
+        self.entries[key] = fitness, pose
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def evaluate(self, genomes, context, simulate):
+        '''Returns the fitness and final pose of every genome (row of genomes), like simulate(genomes) would,
+        but only simulates genomes that are not cached, each once.
+
+        simulate must return (fitness, poses, finished) for the genomes it is given, finished being
+        True for results that do not depend on the other genomes (see Population.run_episode()).
+        Only those are cached.
+        '''
+
+        keys = [self.key(genome, context) for genome in genomes]
+        fitness = np.zeros(len(genomes))
+        poses = np.zeros((len(genomes), 3))
+
+        # Index of the first row of each genome that has to be simulated
+        pending = {}
+        for i, key in enumerate(keys):
+            if key in pending:
+                self.hits += 1
+                continue
+
+            result = self.get(key)
+            if result is None:
+                pending[key] = i
+            else:
+                fitness[i], poses[i] = result
+
+        if len(pending) > 0:
+            rows = np.array(list(pending.values()))
+            new_fitness, new_poses, finished = simulate(genomes[rows])
+            for row, f, pose, done in zip(rows, new_fitness, new_poses, finished):
+                if done:
+                    self.put(keys[row], f, pose)
+
+            fitness[rows], poses[rows] = new_fitness, new_poses
+            # Copies of genomes simulated this time get the same results
+            first = np.array([pending.get(key, i) for i, key in enumerate(keys)])
+            fitness, poses = fitness[first], poses[first]
+
+        return fitness, poses
@@ -0,0 +1,50 @@
+import numpy as np
+
+class Breeder:
+    '''Builds a whole generation of offspring genomes from two parents at once.
+    Genomes are flattened weights followed by flattened biases (see BatchedNeuralNetwork.get_genomes()).
+    All randomness comes from one seeded np.random.Generator, so runs can be reproduced.
+    '''
+
+    def __init__(self, seed=None, mutation='reset', mutation_rate=0.1, mutation_scale=0.1, elitism=0):
+        '''mutation is either 'reset' (mutated parameters are replaced with a standard normal sample)
+        or 'gaussian' (mutated parameters are perturbed by a normal sample with a standard deviation of mutation_scale).
+        The first elitism (0 to 2) offspring are unchanged copies of the parents, best first.
+        '''
+
+        if mutation not in ('reset', 'gaussian'):
+            raise ValueError(f"mutation must be 'reset' or 'gaussian', not {mutation!r}")
+
+        self.rng = np.random.default_rng(seed)
+        self.mutation = mutation
+        self.mutation_rate = mutation_rate
+        self.mutation_scale = mutation_scale
+        self.elitism = elitism
+
+    def breed(self, genome1, genome2, size, weight_count, dtype=float):
+        '''Returns an array of shape (size, genome length) and type dtype of offspring of genome1 and genome2 
+        (genome2 being the fitter parent). The first weight_count parameters of a genome are weights.
+        '''
+
+        genome1 = np.asarray(genome1, dtype)
+        genome2 = np.asarray(genome2, dtype)
+        length = len(genome1)
+
+        # Single point crossover, with separate points for the weights and the biases
+        weight_split = self.rng.integers(weight_count, size=size)
+        bias_split = weight_count + self.rng.integers(length - weight_count, size=size)
+        params = np.arange(length)
+        from_genome1 = params < np.where(params < weight_count, weight_split[:, None], bias_split[:, None])
+        offspring = np.where(from_genome1, genome1, genome2)
+
+        mutated = self.rng.random((size, length), dtype) <= self.mutation_rate
+        if self.mutation == 'reset':
+            offspring[mutated] = self.rng.standard_normal(np.count_nonzero(mutated), dtype)
+        else:
+            offspring[mutated] += self.rng.normal(0, self.mutation_scale, np.count_nonzero(mutated))
+
+        elites = min(self.elitism, 2, size)
+        if elites > 0:
+            offspring[:elites] = (genome2, genome1)[:elites]
+
+        return offspring
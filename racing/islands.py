@@ -0,0 +1,149 @@
+'''Island model training: several populations evolve on their own, each in its own process
+and with its own parents, and every few generations each island sends copies of its best genomes
+to the next island (in a ring). As only those few genomes move between processes,
+islands scale with the number of cores and one stuck population does not hold back the others.
+'''
+
+import multiprocessing
+import os
+
+import numpy as np
+
+from racing.checkpoint import Checkpoint
+from racing.population import Population, get_parents
+
+class Island:
+    '''One population and its Breeder, evolved for a number of generations at a time.
+    Lives in the process of an IslandPool (see _run_island()).
+    '''
+
+    def __init__(self, checkpoint, breeder, walls, wall_tree, distance_field=None,
+                 duration=60, dt=0.02, cutoff=None, swept=False, dtype=float):
+        self.checkpoint = checkpoint
+        self.breeder = breeder
+        self.walls, self.wall_tree, self.distance_field = walls, wall_tree, distance_field
+        self.duration, self.dt, self.cutoff = duration, dt, cutoff
+
+        self.population = Population(checkpoint.x, checkpoint.y, np.radians(checkpoint.angle),
+                                     len(checkpoint.genomes), breeder=breeder, swept=swept,
+                                     dtype=dtype)
+        self.population.brain.set_genomes(checkpoint.genomes)
+        # Set after the population is made, as making its (random) networks draws from the generator
+        breeder.rng.bit_generator.state = checkpoint.rng_state
+
+    def run(self, generations, emigrants=1):
+        '''Simulates and evolves generations generations. Returns the stats of each (rows of generation,
+        best fitness, mean fitness), the parents of the last one (as in saved/parents.json)
+        and copies of its emigrants best genomes, best first.
+        '''
+
+        population = self.population
+        stats = []
+        for _ in range(generations):
+            population.run_episode(self.walls, self.wall_tree, self.duration, self.dt, self.distance_field,
+                                   self.cutoff)
+
+            save = get_parents(population)
+            stats.append([self.checkpoint.generation, population.fitness.max(), population.fitness.mean()])
+            best = np.argsort(population.fitness, kind='stable')[::-1][:emigrants]
+            genomes = population.brain.get_genomes()[best]
+
+            population.evolve(save['parent1']['hyperparams'], save['parent2']['hyperparams'])
+            population.reset()
+            self.checkpoint.generation += 1
+
+        self.checkpoint.stats = np.vstack((self.checkpoint.stats, np.reshape(stats, (-1, 3))))
+        return np.reshape(stats, (-1, 3)), save, genomes
+
+    def receive(self, immigrants):
+        '''Replaces the last genomes of the next generation with immigrants (so that elites are kept).
+        '''
+
+        genomes = self.population.brain.get_genomes()
+        genomes[len(genomes) - len(immigrants):] = immigrants
+        self.population.brain.set_genomes(genomes)
+
+    def get_checkpoint(self):
+        '''Returns a Checkpoint of the next generation, to resume the island from.
+        '''
+
+        self.checkpoint.genomes = self.population.brain.get_genomes()
+        self.checkpoint.rng_state = self.breeder.rng.bit_generator.state
+        return self.checkpoint
+
+def _run_island(connection, args):
+    # Calls methods of an Island for the IslandPool until it sends None
+    island = Island(*args)
+    while (call := connection.recv()) is not None:
+        name, call_args = call
+        try:
+            connection.send((getattr(island, name)(*call_args), None))
+        except Exception as e:
+            connection.send((None, e))
+
+class IslandPool:
+    '''Runs one Island per process, each kept alive (with its population) for the whole of training.
+
+        with IslandPool(checkpoints, breeders, walls, wall_tree) as islands:
+            for stats, parents, emigrants in islands.call('run', [(generations,)] * islands.count):
+                ...
+    '''
+
+    def __init__(self, checkpoints, breeders, walls, wall_tree, distance_field=None,
+                 duration=60, dt=0.02, cutoff=None, swept=False, dtype=float):
+        self.count = len(checkpoints)
+        self.connections = []
+        self.processes = []
+
+        for checkpoint, breeder in zip(checkpoints, breeders):
+            connection, island_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_run_island, daemon=True, args=(
+                island_connection, (checkpoint, breeder, walls, wall_tree, distance_field, duration, dt, cutoff, swept,
+                                     dtype)))
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def call(self, name, args):
+        '''Calls the method name of every island at once, island i with the arguments args[i],
+        and returns what each returned.
+        '''
+
+        for connection, call_args in zip(self.connections, args):
+            connection.send((name, call_args))
+
+        results = [connection.recv() for connection in self.connections]
+        for _, error in results:
+            if error is not None:
+                raise error
+
+        return [result for result, _ in results]
+
+    def migrate(self, emigrants):
+        '''Sends the emigrants of island i (as returned by Island.run()) to island i + 1.
+        '''
+
+        self.call('receive', [(emigrants[i - 1],) for i in range(self.count)])
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def island_paths(directory, count):
+    return [os.path.join(directory, f'{i}.npz') for i in range(count)]
+
+def load_islands(directory, count, new_checkpoint):
+    '''Returns the Checkpoint of each of count islands saved in directory (as 0.npz, 1.npz, ...).
+    Islands without a file are made with new_checkpoint(i).
+    '''
+
+    return [Checkpoint.load(path) if os.path.exists(path) else new_checkpoint(i)
+            for i, path in enumerate(island_paths(directory, count))]
@@ -37,3 +37,66 @@ class NeuralNetwork:
             self.biases.append(biases[bias_index:bias_index + layer])
             bias_index += layer
             weight_index += np.prod(weight_shape)
+
+class BatchedNeuralNetwork:
+    '''A whole population of networks with the same layers. 
+    Weights of layer l are stacked into weights[l] of shape (size, out, in),
+    so network i is weights[l][i] and biases[l][i].
+    '''
+
+    def __init__(self, layers, size, rng=np.random, dtype=float):
+        self.layers = layers
+        self.size = size
+        self.weight_shapes = [(a,b) for a,b in zip(layers[1:], layers[:-1])]
+        self.weight_count = sum(a * b for a, b in self.weight_shapes)
+
+        self.weights = [(rng.standard_normal((size,) + s) / np.sqrt(s[1])).astype(dtype, copy=False)
+                        for s in self.weight_shapes]
+        self.biases = [np.zeros((size, s), dtype) for s in layers[1:]]
+
+    def predict(self, feed, networks=None):
+        '''Evaluates feed[j] with network networks[j] for every j in one pass.
+        feed is of shape (len(networks), layers[0]). All networks are used if networks is None.
+        '''
+
+        if networks is None:
+            networks = np.arange(self.size)
+
+        for w,b in zip(self.weights, self.biases):
+            feed = np.tanh(np.matmul(w[networks], feed[:, :, None])[:, :, 0] + b[networks])
+        return feed
+
+    def get_flattened_hyperparams(self, network):
+        flat_weights = np.concatenate([dense_weights[network].flatten() for dense_weights in self.weights])
+        flat_biases = np.concatenate([bias_layer[network] for bias_layer in self.biases])
+
+        return flat_weights.tolist(), flat_biases.tolist()
+
+    def set_flattened_hyperparams(self, network, weights, biases):
+        bias_index = 0
+        weight_index = 0
+        for layer, weight_shape, dense_weights, bias_layer in zip(self.layers[1:], self.weight_shapes, 
+                                                                   self.weights, self.biases):
+            dense_weights[network] = np.reshape(weights[weight_index:weight_index + np.prod(weight_shape)], weight_shape)
+            bias_layer[network] = biases[bias_index:bias_index + layer]
+            bias_index += layer
+            weight_index += np.prod(weight_shape)
+
+    def get_genomes(self):
+        '''Returns every network's hyperparameters as one array of shape (size, genome length),
+        each row being the flattened weights followed by the flattened biases.
+        '''
+
+        return np.concatenate([w.reshape(self.size, -1) for w in self.weights] + self.biases, axis=1)
+
+    def set_genomes(self, genomes):
+        '''Inverse of get_genomes().
+        '''
+
+        index = 0
+        for dense_weights in self.weights:
+            dense_weights[:] = genomes[:, index:index + dense_weights[0].size].reshape(dense_weights.shape)
+            index += dense_weights[0].size
+        for bias_layer in self.biases:
+            bias_layer[:] = genomes[:, index:index + bias_layer.shape[1]]
+            index += bias_layer.shape[1]
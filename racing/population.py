@@ -0,0 +1,434 @@
+import numpy as np
+
+from racing import collision
+from racing import genetics
+from racing import neural_network as nn
+from racing.profiling import NullProfiler
+
+class Population:
+    '''Every car of a generation stored as a structure of arrays,
+    so that the physics of all live cars can be stepped at once.
+    Car i is described by pos[i], vel[i], angle[i], dead[i], etc.
+    The indices of the cars still alive are kept in active, which shrinks as cars die,
+    so that dead cars cost nothing per tick.
+    '''
+
+    # Size of res/car.png, so that a population can be simulated without a sprite (or a window)
+    car_width = 35
+    car_height = 20
+
+    # Sensors are cast through the BVH on tracks with more walls than this near each wall (see BVH.walls_near()),
+    # and tested against every wall a box around them could hit on tracks with fewer (such as saved/track)
+    sensor_raycast_walls = 24
+
+    def __init__(self, x, y, angle, size, parents=None, evolve=True, breeder=None, num_sensors=7, swept=False,
+                 dtype=float):
+        self.size = size
+        # Whether to also test the path each car moved along in the last tick for collisions, so that
+        # cars cannot pass through walls between ticks however large dt is (see check_swept_collision())
+        self.swept = swept
+        # Floating point type of every per car array (state, buffers and brain), np.float32 to halve memory use
+        self.dtype = np.dtype(dtype)
+        # Set to a racing.profiling.Profiler to time the phases of update()
+        self.profiler = NullProfiler()
+        self.breeder = breeder if breeder is not None else genetics.Breeder()
+        # x, y and angle are either one starting pose for every car or arrays of one per car
+        self.start_pos = np.column_stack(np.broadcast_arrays(x, y)).astype(float)
+        self.start_angle = np.asarray(angle, float)
+
+        # Drag against x velocity = (velocity + drag_shift)^2 * drag_force
+        self.drag_force = 1.4 * 10**-4
+        self.drag_shift = 35
+
+        self.sensor_range = 150
+        # Angles of distance sensors relative to the front of the car (in radians)
+        self.sensor_angles = np.linspace(-np.pi/2, np.pi/2, num=num_sensors)
+
+        self.max_accel = 1100
+        self.max_turn_speed = 6
+
+        # For get_wall_points() function
+        self.half_diagonal = np.sqrt((self.car_width/2)**2 + (self.car_height/2)**2)
+        self.diagonal_angle = np.arcsin(self.car_width / 2 / self.half_diagonal)
+
+        # BVH that get_sensor_readings() last picked a way of reading sensors for
+        self._sensor_tree = None
+
+        # Reused by update() every tick, only the first len(active) rows are used
+        self._wall_points = np.empty((size, 5, 2), self.dtype)
+        self._sensor_points = np.empty((size, num_sensors, 2), self.dtype)
+        self._inputs = np.empty((size, num_sensors + 1), self.dtype)
+
+        # For autonomous control
+        # Inputs are sensor readings and current velocity
+        self.brain = nn.BatchedNeuralNetwork([num_sensors + 1, num_sensors + 4, num_sensors + 4, 2], size, 
+                                            self.breeder.rng, self.dtype)
+        if parents != None:
+            if evolve:
+                self.evolve(parents[0], parents[1])
+            else:
+                for car in range(size):
+                    self.brain.set_flattened_hyperparams(car, parents[0], parents[1])
+
+        self.reset()
+
+    def live(self):
+        '''Returns indices of the cars that are not dead.
+        '''
+
+        return self.active
+
+    def all_dead(self):
+        return len(self.active) == 0
+
+    def drive(self, cars, accel, time):
+        '''Thrusts cars (an array of indices) forward or backward by accel (one value per car).
+        '''
+
+        angle = self.angle[cars]
+        heading = np.stack((np.cos(angle), -np.sin(angle)), axis=1)
+        vel = self.vel[cars] + heading * (accel * time)[:, None]
+
+        # Calculate drag
+        mag = np.sqrt(np.einsum('ij,ij->i', vel, vel))
+        moving = mag > 2
+        # Velocity minus drag
+        vel[moving] -= vel[moving] / mag[moving, None] * ((mag[moving] + self.drag_shift)**2 * self.drag_force)[:, None]
+        # Anything below 2px/s is not visible
+        # so snap to 0 to avoid unnecessary calculations
+        vel[~moving] = 0
+
+        self.vel[cars] = vel
+        self.pos[cars[moving]] += vel[moving] * time
+
+        # Store total forward movement and time passed to calculate average speed after death
+        self.total_movement[cars] += np.einsum('ij,ij->i', vel * time, heading)
+
+        self.kill(cars[np.einsum('ij,ij->i', vel, vel) < 4])
+
+    def turn(self, cars, radians):
+        self.angle[cars] += radians
+        self.total_rotation[cars] += np.abs(radians)
+
+    def get_wall_points(self, cars=None, out=None, previous=False):
+        '''Returns coordinates of vertices of rectangles (cars) as an array of shape (len(cars), 5, 2),
+        each being [top right, bottom right, bottom left, top left, top right].
+        Positions relative to car pointing right. If given, out is filled in and returned.
+        If previous, the rectangles are those of the cars before their last move (only kept when swept).
+        '''
+
+        if cars is None:
+            cars = np.arange(self.size)
+        pos, angle = (self.previous_pos, self.previous_angle) if previous else (self.pos, self.angle)
+
+        small_angle = angle[cars] - self.diagonal_angle
+        big_angle = angle[cars] + self.diagonal_angle
+
+        top_right = np.stack((np.sin(small_angle), np.cos(small_angle)), axis=1) * self.half_diagonal
+        bottom_right = np.stack((np.sin(big_angle), np.cos(big_angle)), axis=1) * self.half_diagonal
+
+        out = np.stack((top_right, bottom_right, -top_right, -bottom_right, top_right), axis=1, out=out)
+        out += pos[cars, None]
+        return out
+
+    def get_sensor_points(self, cars=None, out=None):
+        '''Returns coordinates of furthest points distance sensors could reach
+        as an array of shape (len(cars), num_sensors, 2). If given, out is filled in and returned.
+        '''
+
+        if cars is None:
+            cars = np.arange(self.size)
+
+        angles = self.angle[cars, None] + self.sensor_angles
+        out = np.stack((np.cos(angles), -np.sin(angles)), axis=2, out=out)
+        out *= self.sensor_range
+        out += self.pos[cars, None]
+        return out
+
+    def check_collision(self, walls, owners, possible_collisions, wall_points):
+        '''Returns a boolean array that is True for each car (row of wall_points) that hits a wall.
+        Car owners[j] is tested against wall possible_collisions[j].
+        '''
+
+        # Test every car wall against its candidate wall, 4 car walls per pair
+        segments = walls[possible_collisions]
+        hits = collision.segments_intersecting(wall_points[owners, :-1], wall_points[owners, 1:],
+                                               segments[:, None, :2], segments[:, None, 2:]).any(axis=1)
+
+        return np.bincount(owners[hits], minlength=len(wall_points)) > 0
+
+    def check_swept_collision(self, walls, owners, possible_collisions, wall_points, previous_corners):
+        '''Like check_collision(), but tests the whole region each car swept over in the last tick,
+        from previous_corners (of shape (len(wall_points), 4, 2)) to wall_points.
+        Turns are so small per tick that corners are taken to move in straight lines, so each edge of the outline
+        sweeps a quadrilateral. A wall that a car passed over either crosses the boundary of that region
+        (a corner's path or the car's outline, as it did not touch the previous outline last tick)
+        or has an endpoint inside one of those quadrilaterals.
+
+        Returns (crashed, time of impact), the time of impact being the fraction of the last tick after which
+        each car first touched a wall (1 if only its outline touches one now), or inf if it did not crash.
+        '''
+
+        segments = walls[possible_collisions]
+        wall_starts, wall_ends = segments[:, None, :2], segments[:, None, 2:]
+        outline_hits = collision.segments_intersecting(wall_points[owners, :-1], wall_points[owners, 1:],
+                                                       wall_starts, wall_ends).any(axis=1)
+
+        starts, ends = previous_corners[owners], wall_points[owners, :-1]
+        path_hits = collision.segments_intersecting(starts, ends, wall_starts, wall_ends)
+        lengths = np.sqrt(((ends - starts)**2).sum(axis=2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fractions = collision.intersection_distances(starts, ends, wall_starts, wall_ends) / lengths
+        # Grazing hits can be missed by intersection_distances(), and are then taken to be at the end of the tick
+        fractions = np.where(path_hits, np.fmin(fractions, 1), np.inf).min(axis=1)
+        fractions = np.where(outline_hits, np.minimum(fractions, 1), fractions)
+
+        # Walls (such as short ones between two corners' paths) that the edges passed over without crossing a path
+        corners = np.concatenate((previous_corners[owners], wall_points[owners, :-1]), axis=1)
+        edges = np.arange(4)
+        after = (edges + 1) % 4
+        endpoints = segments.reshape(-1, 1, 2, 2)
+        times = collision.sweep_times(corners[:, edges, None], corners[:, after, None],
+                                      corners[:, edges + 4, None], corners[:, after + 4, None], endpoints)
+        fractions = np.minimum(fractions, times.min(axis=(1, 2)))
+
+        impacts = np.full(len(wall_points), np.inf)
+        np.minimum.at(impacts, owners, fractions)
+        return impacts <= 1, impacts
+
+    def get_sensor_readings(self, cars, wall_tree, sensor_points):
+        '''Returns an array of shape (len(cars), num_sensors) of distances to the nearest wall 
+        along each sensor, found with wall_tree.
+        '''
+
+        if wall_tree is not self._sensor_tree:
+            self._sensor_tree = wall_tree
+            self._raycast_sensors = wall_tree.walls_near(self.sensor_range) > self.sensor_raycast_walls
+
+        if self._raycast_sensors:
+            starts = np.repeat(self.pos[cars], sensor_points.shape[1], axis=0)
+            distances = wall_tree.raycast(starts, sensor_points.reshape(-1, 2)).reshape(sensor_points.shape[:2])
+        else:
+            # Every sensor of a car against every wall near the box around the car and its sensors
+            bbs = wall_tree.get_bounding_boxes(np.concatenate((sensor_points, self.pos[cars, None]), axis=1))
+            owners, walls = self._pairs(wall_tree.query(bbs))
+            segments = wall_tree.walls[walls]
+            distances = np.full(sensor_points.shape[:2], np.inf)
+            np.minimum.at(distances, owners, collision.intersection_distances(
+                self.pos[cars[owners], None], sensor_points[owners], segments[:, None, :2], segments[:, None, 2:]))
+
+        return np.minimum(distances, self.sensor_range)
+
+    @staticmethod
+    def _pairs(possible_collisions):
+        # Turns (offsets, walls) as returned by BVH.query() into (car, wall) pairs
+        offsets, walls = possible_collisions
+        return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)), walls
+
+    def reset(self):
+        self.pos = np.broadcast_to(self.start_pos, (self.size, 2)).astype(self.dtype)
+        self.vel = np.zeros((self.size, 2), self.dtype)
+        self.angle = np.broadcast_to(self.start_angle, self.size).astype(self.dtype)
+        if self.swept:
+            self.previous_pos = self.pos.copy()
+            self.previous_angle = self.angle.copy()
+
+        self.dead = np.zeros(self.size, bool)
+        self.active = np.arange(self.size)
+
+        self.total_movement = np.zeros(self.size, self.dtype)  # Total (forward) movement
+        self.total_rotation = np.zeros(self.size, self.dtype)
+        self.lifespan = np.zeros(self.size, self.dtype)
+        self.fitness = np.zeros(self.size, self.dtype)
+
+    def kill(self, cars=None):
+        if cars is None:
+            cars = self.live()
+
+        self.dead[cars] = True
+        # A new array rather than an update in place, so arrays returned by live() stay as they were
+        self.active = self.active[~self.dead[self.active]]
+        self.fitness[cars] = self.get_fitness(cars)
+
+    def get_fitness(self, cars):
+        '''Returns the fitness cars would have if they died now.
+        '''
+
+        movement = self.total_movement[cars]
+        lifespan = self.lifespan[cars]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fitness = movement * np.abs(movement) * (self.total_rotation[cars] + lifespan) / lifespan**2
+        return np.where(lifespan == 0, 0, fitness)
+
+    def max_fitness(self, cars, time_left, dt):
+        '''Returns an upper bound of the fitness each of cars could have when it dies,
+        if it lives at most time_left more seconds (updated dt at a time).
+        '''
+
+        # drive() never takes a car faster than the speed at which drag cancels out full acceleration
+        # (or than it is already going), and a car cannot turn faster than max_turn_speed
+        accel = self.max_accel * dt
+        terminal_speed = np.sqrt(accel / self.drag_force) - self.drag_shift - accel
+        vel = self.vel[cars]
+        speed = np.maximum(np.sqrt(np.einsum('ij,ij->i', vel, vel)), terminal_speed)
+
+        movement = self.total_movement[cars]
+        lifespan = self.lifespan[cars]
+        # Fitness is (movement / lifespan)^2 * (rotation + lifespan) for forward movement. The first part changes
+        # monotonically with the time lived, so is greatest now or at the end, and the second part grows at most
+        # max_turn_speed + 1 per second
+        now = np.divide(movement, lifespan, out=np.zeros(len(cars)), where=lifespan > 0)
+        later = (movement + speed * time_left) / (lifespan + time_left) if time_left > 0 else now
+        mean_speed = np.maximum(np.maximum(now, later), 0)
+
+        return mean_speed**2 * (self.total_rotation[cars] + lifespan + (self.max_turn_speed + 1) * time_left)
+
+    def evolve(self, hyperparams1, hyperparams2):
+        genomes = self.breeder.breed(np.concatenate(hyperparams1), np.concatenate(hyperparams2), 
+                                     self.size, self.brain.weight_count, self.dtype)
+        self.brain.set_genomes(genomes)
+
+    def update(self, dt, walls, wall_tree, distance_field=None):
+        '''Steps every live car forward by dt. walls is an array of shape (K, 4), each row being x, y, x2, y2,
+        and wall_tree is a BVH built from walls. If a DistanceField of walls is given, only cars near a wall
+        are tested exactly for collisions.
+        '''
+
+        profiler = self.profiler
+        profiler.tick()
+
+        cars = self.live()
+        self.lifespan[cars] += dt
+        profiler.count('live cars', len(cars))
+
+        car_points = self.get_wall_points(cars, self._wall_points[:len(cars)])
+        sensor_points = self.get_sensor_points(cars, self._sensor_points[:len(cars)])
+        if self.swept:
+            previous_corners = self.get_wall_points(cars, previous=True)[:, :-1]
+
+        # Cars that are certainly away from every wall need no exact test
+        near = np.arange(len(cars))
+        if distance_field is not None:
+            with profiler.phase('distance field'):
+                clear = distance_field.clear(car_points)
+                if self.swept:
+                    # Every point a car swept over is within half a diagonal of its center's path
+                    # (the outline is always within that of the center, and moves between its poses linearly)
+                    path = np.stack((self.previous_pos[cars], self.pos[cars]), axis=1)
+                    clear &= distance_field.clear(path, self.half_diagonal)
+                near = np.flatnonzero(~clear)
+            profiler.count('cars near walls', len(near))
+
+        with profiler.phase('bounding boxes'):
+            if self.swept:
+                swept_points = np.concatenate((car_points[near], previous_corners[near]), axis=1)
+                car_bbs = wall_tree.get_bounding_boxes(swept_points)
+            else:
+                car_bbs = wall_tree.get_bounding_boxes(car_points[near])
+
+        with profiler.phase('tree query'):
+            possible_car_collisions = wall_tree.query(car_bbs)
+        profiler.count('car candidate walls', len(possible_car_collisions[1]))
+
+        # Check which cars have died
+        with profiler.phase('collision'):
+            crashed = np.zeros(len(cars), bool)
+            if self.swept:
+                crashed[near], impacts = self.check_swept_collision(walls, *self._pairs(possible_car_collisions),
+                                                                    car_points[near], previous_corners[near])
+                # Move crashed cars back to where they hit the wall, and take the movement past it out of their
+                # fitness. Their lifespan keeps counting whole ticks, as the time limit, racing.cutoff and replays
+                # count ticks, so at most one tick of it is after the impact
+                hit = cars[near][crashed[near]]
+                back = 1 - impacts[crashed[near]]
+                moved = self.pos[hit] - self.previous_pos[hit]
+                heading = np.stack((np.cos(self.angle[hit]), -np.sin(self.angle[hit])), axis=1)
+                self.total_movement[hit] -= back * np.einsum('ij,ij->i', moved, heading)
+                self.pos[hit] -= back[:, None] * moved
+                self.angle[hit] -= back * (self.angle[hit] - self.previous_angle[hit])
+            else:
+                crashed[near] = self.check_collision(walls, *self._pairs(possible_car_collisions), car_points[near])
+            self.kill(cars[crashed])
+
+        with profiler.phase('sensors'):
+            readings = self.get_sensor_readings(cars, wall_tree, sensor_points)
+        cars = cars[~crashed]
+        if len(cars) == 0:
+            return
+
+        with profiler.phase('inference'):
+            inputs = self._inputs[:len(cars)]
+            inputs[:, :-1] = readings[~crashed]
+            vel = self.vel[cars]
+            np.sqrt(np.einsum('ij,ij->i', vel, vel), out=inputs[:, -1])
+            t, m = self.brain.predict(inputs, cars).T
+
+        with profiler.phase('physics'):
+            if self.swept:
+                self.previous_pos[cars] = self.pos[cars]
+                self.previous_angle[cars] = self.angle[cars]
+            # Maybe do the math to turn and drive at the same time?
+            self.turn(cars, t * self.max_turn_speed * dt)
+            self.drive(cars, m * self.max_accel, dt)
+
+    def run_episode(self, walls, wall_tree, duration=60, dt=0.02, distance_field=None, cutoff=None, recorder=None):
+        '''Updates the population until every car has died or duration seconds have passed,
+        then kills the cars still alive. If a racing.cutoff.EarlyCutoff is given,
+        the episode also ends as soon as it allows. If a racing.trajectory.TrajectoryRecorder is given,
+        every tick is recorded with it.
+
+        Returns a boolean array that is True for cars whose fitness does not depend on the rest of the population
+        (every car, unless the cutoff ended the episode early).
+        '''
+
+        time = 0
+        finished = np.ones(self.size, bool)
+        if cutoff is not None:
+            cutoff.reset(self)
+        if recorder is not None:
+            recorder.reset(self)
+        while not self.all_dead() and time < duration:
+            self.update(dt, walls, wall_tree, distance_field)
+            time += dt
+            if recorder is not None:
+                recorder.record(self)
+            if cutoff is not None and cutoff.update(self, time, duration, dt):
+                finished = self.dead.copy()
+                break
+
+        self.kill()
+        return finished
+
+    def physics_constants(self):
+        '''Returns every constant that the simulation of a car depends on, besides its brain.
+        '''
+
+        return (self.car_width, self.car_height, self.drag_force, self.drag_shift, self.sensor_range,
+                tuple(self.sensor_angles.tolist()), self.max_accel, self.max_turn_speed, tuple(self.brain.layers),
+                self.swept, self.dtype.name)
+
+    def bytes_per_car(self):
+        '''Returns the memory used by the arrays of the population (including its brain) divided by its size.
+        Constants shared by every car (like sensor_angles) are not counted, as they do not grow with the population.
+        '''
+
+        arrays = [value for value in vars(self).values() if isinstance(value, np.ndarray)]
+        arrays += self.brain.weights + self.brain.biases
+        return sum(array.nbytes for array in arrays if array.ndim > 0 and len(array) == self.size) / self.size
+
+    def get_save_formatted(self, car):
+        # Python floats, as json cannot write float32 (see dtype)
+        return {'fitness': float(self.fitness[car]), 'x': float(self.pos[car, 0]), 'y': float(self.pos[car, 1]),
+                'angle': float(np.degrees(self.angle[car])), 'hyperparams': self.brain.get_flattened_hyperparams(car)}
+
+def get_parents(population):
+    '''Returns the two cars with the greatest fitness in the format of saved/parents.json.
+    '''
+
+    bests = np.argsort(population.fitness, kind='stable')[-2:]
+    save = {'parent1': population.get_save_formatted(bests[0]),
+            'parent2': population.get_save_formatted(bests[1])}
+    for parent in save.values():
+        del parent['fitness']
+
+    return save
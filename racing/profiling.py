@@ -0,0 +1,109 @@
+import contextlib
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+
+class Profiler:
+    '''Times the phases of each tick and counts things (live cars, candidate walls, ...) over a generation.
+    Summaries of each generation can be appended to a .jsonl or .csv file.
+
+        with profiler.phase('physics'):
+            ...
+        profiler.count('live cars', len(cars))
+    '''
+
+    enabled = True
+
+    def __init__(self, path=None):
+        self.path = path
+        self.last_summary = None
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.counters = defaultdict(float)
+        self.ticks = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def tick(self):
+        self.ticks += 1
+
+    def summary(self, generation=None):
+        '''Returns milliseconds per tick spent in each phase and the mean of each counter per tick.
+        '''
+
+        ticks = max(self.ticks, 1)
+        summary = {'generation': generation, 'ticks': self.ticks}
+        summary.update({f'{name} ms': seconds * 1000 / ticks for name, seconds in self.times.items()})
+        summary.update({name: total / ticks for name, total in self.counters.items()})
+
+        return summary
+
+    def end_generation(self, generation):
+        '''Writes the summary of the generation that just finished (if there is a path) and starts a new one.
+        '''
+
+        self.last_summary = self.summary(generation)
+
+        if self.path is not None:
+            if self.path.endswith('.csv'):
+                # Keep the columns of the file's header if it already has one
+                fields = list(self.last_summary.keys())
+                new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                if not new_file:
+                    with open(self.path, newline='') as f:
+                        fields = next(csv.reader(f))
+
+                with open(self.path, 'a', newline='') as f:
+                    writer = csv.DictWriter(f, fields, restval=0, extrasaction='ignore')
+                    if new_file:
+                        writer.writeheader()
+                    writer.writerow(self.last_summary)
+            else:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(self.last_summary) + '\n')
+
+        self.reset()
+        return self.last_summary
+
+    def overlay_text(self):
+        '''Returns the last summary as lines of text, for showing on screen.
+        '''
+
+        if self.last_summary is None:
+            return 'Profiling...'
+
+        return '\n'.join(f'{name}: {value:.2f}' for name, value in self.last_summary.items()
+                         if name not in ('generation', 'ticks'))
+
+class NullProfiler:
+    '''Does nothing, for when profiling is off. Has the same methods as Profiler.
+    '''
+
+    enabled = False
+    last_summary = None
+    _phase = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, value=1):
+        pass
+
+    def tick(self):
+        pass
+
+    def end_generation(self, generation):
+        pass
@@ -0,0 +1,67 @@
+import numpy as np
+import pyglet
+from pyglet.gl import GL_ONE_MINUS_SRC_ALPHA, GL_SRC_ALPHA, GL_TRIANGLES
+
+from racing import res
+
+class CarRenderer:
+    '''Draws many cars as a single vertex list (with the same shader as pyglet sprites),
+    so that a frame costs one write of a few arrays instead of a sprite update per car.
+    Each car has a state (ALIVE, DEAD or GHOST) picking its image, and images are never swapped:
+    all of them are regions of the same texture (as pyglet.resource puts them in one atlas),
+    and the state only picks the texture coordinates.
+    '''
+
+    ALIVE, DEAD, GHOST = range(3)
+
+    def __init__(self, count, batch=None, images=None):
+        if images is None:
+            images = res.car_img, res.dead_car_img, res.ghost_car_img
+        if len({image.get_texture().id for image in images}) > 1:
+            raise ValueError('every image must be a region of the same texture')
+
+        self.count = count
+        program = pyglet.sprite.get_default_shader()
+        group = pyglet.sprite.SpriteGroup(images[0].get_texture(), GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, program)
+
+        # Corners (relative to the anchor) and texture coordinates of the 4 vertices of each state's image
+        self.corners = np.array([(-image.anchor_x, -image.anchor_y, 0,
+                                  image.width - image.anchor_x, -image.anchor_y, 0,
+                                  image.width - image.anchor_x, image.height - image.anchor_y, 0,
+                                  -image.anchor_x, image.height - image.anchor_y, 0) for image in images], np.float32)
+        self.tex_coords = np.array([image.tex_coords for image in images], np.float32)
+
+        indices = (np.arange(count)[:, None] * 4 + [0, 1, 2, 0, 2, 3]).ravel()
+        self.vertex_list = program.vertex_list_indexed(count * 4, GL_TRIANGLES, indices.tolist(), batch, group,
+                                                       position=('f', np.tile(self.corners[0], count)),
+                                                       colors=('Bn', (255,) * 4 * 4 * count),
+                                                       translate=('f', (0,) * 3 * 4 * count),
+                                                       scale=('f', (1,) * 2 * 4 * count),
+                                                       rotation=('f', (0,) * 4 * count),
+                                                       tex_coords=('f', np.tile(self.tex_coords[0], count)))
+
+    @staticmethod
+    def _view(region, count):
+        # A numpy view of a region of a vertex list's attribute, with one row per car
+        return np.ctypeslib.as_array(region).reshape(count, -1)
+
+    def update(self, pos, angle, states, shown=None):
+        '''Moves car i to pos[i] (x, y) facing angle[i] (in radians, as in Population) and draws it as states[i].
+        Cars where shown is False are not drawn.
+        '''
+
+        translate = self._view(self.vertex_list.translate, self.count)
+        translate[:, 0::3] = pos[:, 0, None]
+        translate[:, 1::3] = pos[:, 1, None]
+
+        self._view(self.vertex_list.rotation, self.count)[:] = np.degrees(angle)[:, None]
+
+        corners = self.corners[states]
+        if shown is not None:
+            # Hidden cars are squashed into a point, as pyglet does with invisible sprites
+            corners[~shown] = 0
+        self._view(self.vertex_list.position, self.count)[:] = corners
+        self._view(self.vertex_list.tex_coords, self.count)[:] = self.tex_coords[states]
+
+    def delete(self):
+        self.vertex_list.delete()
@@ -1,3 +1,5 @@
+import os
+
 import pyglet
 
 def centered(location):
@@ -7,7 +9,10 @@ def centered(location):
 
     return image
 
-pyglet.resource.path = ['res']
+# An absolute path, as pyglet resolves relative ones against the directory of __main__
+# (which is benchmarks/ under python -m benchmarks.run)
+RES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'res')
+pyglet.resource.path = [RES_DIR]
 pyglet.resource.reindex()
 
 car_img = centered('car.png')
@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+def atomic_write(path, write):
+    '''Calls write with a binary file opened next to path, then renames the file to path,
+    so a crash never leaves a half written file behind.
+    '''
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def json_writer(data):
+    '''Returns a function writing data as JSON to a binary file, for atomic_write() and BackgroundWriter.
+    '''
+
+    return lambda f: f.write(json.dumps(data).encode())
+
+class BackgroundWriter:
+    '''Writes files (with atomic_write()) from a background thread, so that saving does not stall the caller.
+
+    Files waiting to be written are kept by path: submitting a path that is still waiting replaces
+    its older contents, so only the latest snapshot is written when the disk falls behind.
+    At most max_pending paths wait at once, after which submit() blocks until one is written.
+    A write that fails is reported and raised again by the next submit(), flush() or close().
+
+        writer.submit('saved/parents.json', json_writer(parents))
+        ...
+        writer.close()  # Writes everything still waiting
+    '''
+
+    def __init__(self, max_pending=8):
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.writing = False
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='BackgroundWriter', daemon=True)
+        self.thread.start()
+
+    def submit(self, path, write):
+        '''Queues a write of path. write is called with a binary file from the background thread,
+        so it must only use data that the caller will not change (a snapshot).
+        '''
+
+        with self.condition:
+            self._raise_error()
+            if self.closed:
+                raise ValueError('submit() on a closed BackgroundWriter')
+
+            while path not in self.pending and len(self.pending) >= self.max_pending:
+                self.condition.wait()
+            self.pending[path] = write
+            self.condition.notify_all()
+
+    def flush(self):
+        '''Blocks until every queued file has been written.
+        '''
+
+        with self.condition:
+            while self.pending or self.writing:
+                self.condition.wait()
+            self._raise_error()
+
+    def close(self):
+        '''Writes every queued file and stops the background thread.
+        '''
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+
+                path, write = self.pending.popitem(last=False)
+                self.writing = True
+                self.condition.notify_all()
+
+            try:
+                atomic_write(path, write)
+            except Exception as e:
+                print(f'Could not write {path}: {e!r}', file=sys.stderr)
+                error = e
+            else:
+                error = None
+
+            with self.condition:
+                self.error = self.error or error
+                self.writing = False
+                self.condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
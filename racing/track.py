@@ -0,0 +1,47 @@
+import hashlib
+
+import numpy as np
+
+def load_track(path):
+    '''Reads a track file, where each line is a polyline of x y coordinates,
+    and returns its walls as an array of shape (K, 4), each row being x, y, x2, y2.
+    '''
+
+    walls = []
+    with open(path) as f:
+        for line in f:
+            if not line.isspace():
+                vals = np.array(line.split(), float)
+                walls.extend(zip(vals[:-2:2], vals[1:-1:2], vals[2::2], vals[3::2]))
+
+    return np.array(walls, float).reshape(-1, 4)
+
+def track_hash(walls):
+    '''Returns a hex digest identifying the walls of a track.
+    '''
+
+    return hashlib.sha256(np.ascontiguousarray(walls, float).tobytes()).hexdigest()
+
+def generate_track(num_walls, seed=None, center=(650, 400), radius=300, width=80):
+    '''Procedurally generates a closed track of two wobbly loops, each made of num_walls // 2 walls.
+    Returns the walls (as load_track() does) and a starting pose (x, y, angle in radians) between the loops.
+    '''
+
+    rng = np.random.default_rng(seed)
+    points = max(num_walls // 2, 3)
+    theta = np.linspace(0, 2 * np.pi, points + 1)
+
+    # Sum of a few random low frequency waves, so the loops bend without crossing each other
+    wobble = sum(rng.uniform(-0.15, 0.15) / k * np.sin(k * theta + rng.uniform(0, 2 * np.pi)) for k in range(1, 6))
+    outer = radius * (1 + wobble)
+    inner = outer - width
+
+    walls = []
+    for r in (outer, inner):
+        xs = center[0] + r * np.cos(theta)
+        ys = center[1] + r * np.sin(theta) * 0.6
+        walls.append(np.column_stack((xs[:-1], ys[:-1], xs[1:], ys[1:])))
+
+    # Halfway between the loops at theta = 0, facing up (counterclockwise around the track)
+    start = (float(center[0] + (outer[0] + inner[0]) / 2), center[1], -np.pi / 2)
+    return np.concatenate(walls), start
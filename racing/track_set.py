@@ -0,0 +1,85 @@
+import numpy as np
+
+from racing.bvh import BVH
+from racing.distance_field import DistanceField
+from racing.track import track_hash
+
+# Ways of combining the fitness a genome gets on each track into one
+REDUCTIONS = {'mean': np.mean, 'min': np.min}
+
+class TrackSet:
+    '''Several tracks, each with its own starting pose, laid side by side as one set of walls with one BVH,
+    so that every genome can be simulated on every track in the same Population (and so the same batched steps).
+    The first track stays where it is, and each other track is moved right of the previous one,
+    far enough that no car or sensor on one track can reach another.
+
+    Track k has walls walls[wall_offsets[k]:wall_offsets[k + 1]], moved by offsets[k] (x, y) from its own file.
+    With G genomes, car g * K + k of the population is genome g on track k.
+    '''
+
+    def __init__(self, tracks, starts, spacing=200):
+        '''tracks is a list of racing.compiled_track.CompiledTrack, and starts the starting pose
+        (x, y, angle in radians) on each. spacing is the empty space left between tracks,
+        which must be more than a sensor's range. If every track has a distance field,
+        so does the set (see TrackSetDistanceField), and it is None otherwise.
+        '''
+
+        if len(tracks) != len(starts) or len(tracks) == 0:
+            raise ValueError('there must be one starting pose for every track, and at least one track')
+
+        fields = [track.distance_field for track in tracks]
+        tracks = [np.asarray(track.walls, float).reshape(-1, 4) for track in tracks]
+        self.hashes = [track_hash(walls) for walls in tracks]
+        self.count = len(tracks)
+
+        self.offsets = np.zeros((self.count, 2))
+        right = -np.inf
+        for k, (walls, start) in enumerate(zip(tracks, starts)):
+            xs = np.concatenate((walls[:, 0], walls[:, 2], [start[0]]))
+            if k > 0:
+                self.offsets[k, 0] = right + spacing - xs.min()
+            right = xs.max() + self.offsets[k, 0]
+
+        self.wall_offsets = np.concatenate(([0], np.cumsum([len(walls) for walls in tracks])))
+        self.walls = np.concatenate([walls + np.tile(offset, 2) for walls, offset in zip(tracks, self.offsets)])
+        self.wall_tree = BVH(self.walls)
+        self.distance_field = None
+        if all(field is not None for field in fields):
+            self.distance_field = TrackSetDistanceField(fields, self.offsets)
+
+        starts = np.asarray(starts, float).reshape(-1, 3)
+        self.starts = np.column_stack((starts[:, :2] + self.offsets, starts[:, 2]))
+
+    def expand(self, genomes):
+        '''Returns every genome repeated once per track, and the starting x, y and angle of each copy.
+        '''
+
+        genomes = np.repeat(genomes, self.count, axis=0)
+        starts = np.tile(self.starts, (len(genomes) // self.count, 1))
+        return genomes, starts[:, 0], starts[:, 1], starts[:, 2]
+
+    def reduce(self, fitness, poses, finished, reduction='mean'):
+        '''Turns the results of simulating expand(genomes) (as returned by ParallelEvaluator.evaluate())
+        into one result per genome: its fitness over every track combined with reduction (a name in REDUCTIONS),
+        its final pose on the first track, and whether every copy of it finished.
+        '''
+
+        fitness = REDUCTIONS[reduction](np.reshape(fitness, (-1, self.count)), axis=1)
+        poses = np.reshape(poses, (-1, self.count, 3))[:, 0]
+        finished = np.reshape(finished, (-1, self.count)).all(axis=1)
+        return fitness, poses, finished
+
+class TrackSetDistanceField(DistanceField):
+    '''The distance fields of the tracks of a TrackSet (as cached in their compiled tracks), each moved by its
+    track's offset, used as one DistanceField of every wall without building a field of the whole set.
+    '''
+
+    def __init__(self, fields, offsets):
+        self.fields = fields
+        self.offsets = offsets
+        self.cell_size = min(field.cell_size for field in fields)
+
+    def lower_bounds(self, points):
+        # Points far from a field (such as those on another track) get their distance to its grid
+        return np.min([field.lower_bounds(points - offset) for field, offset in zip(self.fields, self.offsets)],
+                      axis=0)
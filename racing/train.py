@@ -0,0 +1,275 @@
+'''Trains cars without a window, as fast as the CPU allows.
+
+    $ python -m racing.train --track saved/track --generations 100
+
+Reads and writes the same saved/setup.json and saved/parents.json as racing.py,
+so training can be continued in either. With --checkpoint, the whole population is
+also saved every generation and training resumes exactly from it.
+
+With --islands N, N populations evolve in their own processes and swap their best genomes
+every --migration-interval generations (see racing.islands). Each island is saved as a checkpoint
+in an islands folder next to --parents, and resumed from it.
+'''
+
+import argparse
+import copy
+import os
+
+import numpy as np
+
+from racing.checkpoint import Checkpoint
+from racing.compiled_track import load_compiled_track
+from racing.cutoff import EarlyCutoff
+from racing.evaluation import ParallelEvaluator
+from racing.fitness_cache import FitnessCache
+from racing.genetics import Breeder
+from racing.islands import IslandPool, island_paths, load_islands
+from racing.population import Population, get_parents
+from racing.profiling import Profiler
+from racing.saving import BackgroundWriter, json_writer
+from racing.track import track_hash
+from racing.track_set import REDUCTIONS, TrackSet
+from racing.trajectory import replay_best
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Train cars without a window.')
+    parser.add_argument('--track', default='saved/track')
+    parser.add_argument('--generations', type=int, default=1)
+    parser.add_argument('--population', type=int, default=500)
+    parser.add_argument('--setup', default='saved/setup.json')
+    parser.add_argument('--parents', default='saved/parents.json')
+    parser.add_argument('--checkpoint', help='.npz file holding the whole population, resumed from if it exists')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes to simulate with')
+    parser.add_argument('--duration', type=float, default=60, help='seconds per generation')
+    parser.add_argument('--dt', type=float, default=0.02)
+    parser.add_argument('--swept', action='store_true',
+                        help='test the path cars moved along each tick for collisions, so that a larger --dt '
+                             '(e.g. 0.05 to 0.1) cannot let cars pass through walls')
+    parser.add_argument('--compact', action='store_true',
+                        help='store the state and genomes of cars as 32 bit floats, to fit larger populations')
+    parser.add_argument('--seed', type=int, help='seed of the random number generator, for reproducible runs')
+    parser.add_argument('--mutation', choices=['reset', 'gaussian'], default='reset')
+    parser.add_argument('--mutation-rate', type=float, default=0.1)
+    parser.add_argument('--mutation-scale', type=float, default=0.1, 
+                        help='standard deviation of gaussian mutations')
+    parser.add_argument('--distance-field', type=float, metavar='CELL_SIZE',
+                        help='skip exact collision tests for cars away from walls using a distance grid '
+                             'with cells of this size (cached in saved/cache)')
+    parser.add_argument('--profile', help='.jsonl or .csv file to append a timing summary of each generation to '
+                                          '(phases are only timed when simulating in this process)')
+    parser.add_argument('--early-cutoff', action='store_true',
+                        help='end each generation once no live car can beat the best two (same parents, less time)')
+    parser.add_argument('--stagnation', type=float, metavar='SECONDS',
+                        help='with --early-cutoff, also kill cars that barely moved forward in this many seconds')
+    parser.add_argument('--fitness-cache', type=int, default=0, metavar='SIZE',
+                        help='remember the results of up to this many genomes, so that copies are not simulated again')
+    parser.add_argument('--record', type=int, default=0, metavar='COUNT',
+                        help='save the trajectories of this many of the best cars of each generation '
+                             '(in a trajectories folder next to --parents) to replay in racing.py; '
+                             'they are simulated again after the generation, so only they are kept in memory')
+    parser.add_argument('--elitism', type=int, default=0, help='number of parents (0 to 2) copied unchanged')
+    parser.add_argument('--extra-track', nargs=4, action='append', default=[], metavar=('TRACK', 'X', 'Y', 'ANGLE'),
+                        help='also simulate every car on this track, starting at x, y and angle (in degrees), '
+                             'in the same batch (may be given several times)')
+    parser.add_argument('--reduction', choices=sorted(REDUCTIONS), default='mean',
+                        help='how the fitness of a car on each track is combined, with --extra-track')
+    parser.add_argument('--islands', type=int, default=0, metavar='N',
+                        help='evolve N populations of --population cars, each in its own process')
+    parser.add_argument('--migration-interval', type=int, default=10, metavar='M',
+                        help='with --islands, generations between each island sending its best genomes to the next')
+    parser.add_argument('--migrants', type=int, default=1, help='with --islands, number of genomes sent each migration')
+    args = parser.parse_args(args)
+
+    if args.migration_interval < 1:
+        parser.error('--migration-interval must be at least 1')
+
+    if args.record > 0 and (args.workers > 1 or args.fitness_cache > 0):
+        parser.error('--record needs every car to be simulated in this process (no --workers or --fitness-cache)')
+    if args.islands > 0 and (args.workers > 1 or args.fitness_cache > 0 or args.record > 0
+                             or args.checkpoint is not None or args.profile is not None):
+        parser.error('--islands runs a process per island and saves them itself '
+                     '(no --workers, --fitness-cache, --record, --checkpoint or --profile)')
+    if args.extra_track and (args.early_cutoff or args.record > 0 or args.islands > 0):
+        parser.error('--extra-track picks parents from fitness combined over every track '
+                     '(no --early-cutoff, --record or --islands)')
+
+    # Compiled (with its BVH and distance field) into saved/cache the first time the track is used
+    track = load_compiled_track(args.track, args.distance_field)
+    walls, wall_tree = track.walls, track.wall_tree
+    distance_field = track.distance_field if args.distance_field else None
+
+    dtype = np.float32 if args.compact else float
+    if args.islands > 0:
+        train_islands(args, parser, walls, wall_tree, distance_field, dtype)
+        return
+
+    breeder = Breeder(args.seed, args.mutation, args.mutation_rate, args.mutation_scale, args.elitism)
+    if args.checkpoint is not None and os.path.exists(args.checkpoint):
+        checkpoint = Checkpoint.load(args.checkpoint)
+        if checkpoint.track_hash not in (None, track_hash(walls)):
+            parser.error(f'{args.checkpoint} was saved while training on a different track')
+    else:
+        checkpoint = Checkpoint.from_json(args.setup, args.parents, args.population, breeder, dtype)
+    checkpoint.track_hash = track_hash(walls)
+
+    generation = checkpoint.generation
+    start_angle = np.radians(checkpoint.angle)
+
+    track_set = None
+    if args.extra_track:
+        # The first track is --track, from the starting pose in --setup
+        tracks = [track] + [load_compiled_track(path, args.distance_field) for path, *_ in args.extra_track]
+        starts = [(checkpoint.x, checkpoint.y, start_angle)] + [(float(x), float(y), np.radians(float(angle)))
+                                                                for _, x, y, angle in args.extra_track]
+        track_set = TrackSet(tracks, starts)
+        if not args.distance_field:
+            # Compiled tracks keep the fields they were once compiled with
+            track_set.distance_field = None
+
+    population = Population(checkpoint.x, checkpoint.y, start_angle, len(checkpoint.genomes), breeder=breeder,
+                            swept=args.swept, dtype=dtype)
+    print(f'{population.bytes_per_car():.0f} bytes per car')
+    population.brain.set_genomes(checkpoint.genomes)
+    # Set after the population is made, as making its (random) networks draws from the generator
+    breeder.rng.bit_generator.state = checkpoint.rng_state
+    if args.profile is not None:
+        population.profiler = Profiler(args.profile)
+
+    cutoff = EarlyCutoff(args.stagnation) if args.early_cutoff else None
+    if track_set is None:
+        evaluator = ParallelEvaluator(walls, args.workers, distance_field, wall_tree) if args.workers > 1 else None
+    else:
+        evaluator = (ParallelEvaluator(track_set.walls, args.workers, track_set.distance_field, track_set.wall_tree)
+                     if args.workers > 1 else None)
+
+    if args.record > 0:
+        trajectory_dir = os.path.join(os.path.dirname(args.parents), 'trajectories')
+        os.makedirs(trajectory_dir, exist_ok=True)
+
+    cache = FitnessCache(args.fitness_cache) if args.fitness_cache > 0 else None
+    context = FitnessCache.context(checkpoint.track_hash, checkpoint.x, checkpoint.y, checkpoint.angle, args.duration,
+                                   args.dt, None if cutoff is None else (cutoff.stagnation, cutoff.min_progress),
+                                   population.physics_constants(),
+                                   None if track_set is None else (track_set.hashes, track_set.starts.tolist(),
+                                                                   args.reduction))
+
+    def simulate(genomes):
+        if track_set is not None:
+            copies, x, y, angle = track_set.expand(genomes)
+            if evaluator is not None:
+                results = evaluator.evaluate(copies, x, y, angle, args.duration, args.dt, None, args.swept, dtype)
+            else:
+                episode = Population(x, y, angle, len(copies), swept=args.swept, dtype=dtype)
+                episode.brain.set_genomes(copies)
+                episode.profiler = population.profiler
+                finished = episode.run_episode(track_set.walls, track_set.wall_tree, args.duration, args.dt,
+                                               track_set.distance_field)
+                results = episode.fitness, np.column_stack((episode.pos, episode.angle)), finished
+            return track_set.reduce(*results, args.reduction)
+
+        if evaluator is not None:
+            return evaluator.evaluate(genomes, checkpoint.x, checkpoint.y, start_angle, args.duration, args.dt, cutoff,
+                                      args.swept, dtype)
+
+        episode = Population(checkpoint.x, checkpoint.y, start_angle, len(genomes), swept=args.swept, dtype=dtype)
+        episode.brain.set_genomes(genomes)
+        episode.profiler = population.profiler
+        finished = episode.run_episode(walls, wall_tree, args.duration, args.dt, distance_field, cutoff)
+        return episode.fitness, np.column_stack((episode.pos, episode.angle)), finished
+
+    # Files are written in the background while the next generation is simulated
+    writer = BackgroundWriter()
+
+    try:
+        for _ in range(args.generations):
+            if cache is None and evaluator is None and track_set is None:
+                population.run_episode(walls, wall_tree, args.duration, args.dt, distance_field, cutoff)
+            else:
+                genomes = population.brain.get_genomes()
+                if cache is not None:
+                    fitness, poses = cache.evaluate(genomes, context, simulate)
+                else:
+                    fitness, poses, _ = simulate(genomes)
+                population.fitness[:] = fitness
+                population.pos[:] = poses[:, :2]
+                population.angle[:] = poses[:, 2]
+
+            population.profiler.end_generation(generation)
+            save = get_parents(population)
+            population_best, population_mean = population.fitness.max(), population.fitness.mean()
+            print(f'Gen {generation}: best fitness {population_best:.3f}, mean fitness {population_mean:.3f}'
+                  + (f', fitness cache hit rate {cache.hit_rate():.1%}' if cache is not None else ''))
+
+            writer.submit(args.parents, json_writer(save))
+            if args.record > 0:
+                # Only the best cars are simulated again and recorded, so memory does not grow with the population
+                writer.submit(os.path.join(trajectory_dir, f'{generation}.npz'),
+                              replay_best(population, args.record, walls, wall_tree, args.dt, generation,
+                                          distance_field).write)
+
+            generation += 1
+            writer.submit(args.setup, json_writer({'generation': generation, 'x': checkpoint.x,
+                                                   'y': checkpoint.y, 'angle': checkpoint.angle}))
+
+            population.evolve(save['parent1']['hyperparams'], save['parent2']['hyperparams'])
+            population.reset()
+
+            if args.checkpoint is not None:
+                checkpoint.genomes = population.brain.get_genomes()
+                checkpoint.generation = generation
+                checkpoint.rng_state = breeder.rng.bit_generator.state
+                checkpoint.stats = np.vstack((checkpoint.stats, [generation - 1, population_best, population_mean]))
+                # A copy, as the checkpoint's attributes are replaced next generation while it is being written
+                writer.submit(args.checkpoint, copy.copy(checkpoint).write)
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+        writer.close()
+
+def train_islands(args, parser, walls, wall_tree, distance_field, dtype):
+    island_dir = os.path.join(os.path.dirname(args.parents), 'islands')
+    os.makedirs(island_dir, exist_ok=True)
+
+    # Each island has its own stream of random numbers, derived from --seed
+    breeders = [Breeder(None if args.seed is None else (args.seed, i), args.mutation, args.mutation_rate,
+                        args.mutation_scale, args.elitism) for i in range(args.islands)]
+    checkpoints = load_islands(island_dir, args.islands,
+                               lambda i: Checkpoint.from_json(args.setup, args.parents, args.population, breeders[i],
+                                                              dtype))
+    for path, checkpoint in zip(island_paths(island_dir, args.islands), checkpoints):
+        if checkpoint.track_hash not in (None, track_hash(walls)):
+            parser.error(f'{path} was saved while training on a different track')
+        checkpoint.track_hash = track_hash(walls)
+
+    generation = checkpoints[0].generation
+    last_generation = generation + args.generations
+    cutoff = EarlyCutoff(args.stagnation) if args.early_cutoff else None
+
+    with BackgroundWriter() as writer, IslandPool(checkpoints, breeders, walls, wall_tree, distance_field,
+                                                  args.duration, args.dt, cutoff, args.swept, dtype) as islands:
+        while generation < last_generation:
+            # Migrations happen after every generation that is a multiple of the interval, even across runs
+            generations = min(args.migration_interval - (generation - 1) % args.migration_interval,
+                              last_generation - generation)
+            stats, parents, emigrants = zip(*islands.call('run', [(generations, args.migrants)] * islands.count))
+
+            for i in range(generations):
+                best = np.array([island_stats[i, 1] for island_stats in stats])
+                mean = np.mean([island_stats[i, 2] for island_stats in stats])
+                print(f'Gen {generation + i}: best fitness {best.max():.3f} (island {best.argmax()}), '
+                      f'mean fitness {mean:.3f}')
+
+            generation += generations
+            if (generation - 1) % args.migration_interval == 0:
+                islands.migrate(emigrants)
+
+            # The parents of the island with the best car, so that racing.py continues from them
+            writer.submit(args.parents, json_writer(parents[best.argmax()]))
+            writer.submit(args.setup, json_writer({'generation': generation, 'x': checkpoints[0].x,
+                                                   'y': checkpoints[0].y, 'angle': checkpoints[0].angle}))
+            for path, checkpoint in zip(island_paths(island_dir, islands.count),
+                                        islands.call('get_checkpoint', [()] * islands.count)):
+                writer.submit(path, checkpoint.write)
+
+if __name__ == '__main__':
+    main()
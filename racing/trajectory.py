@@ -0,0 +1,121 @@
+import numpy as np
+
+from racing.population import Population
+from racing.saving import atomic_write
+
+class Trajectories:
+    '''Poses (x, y, angle in radians) of a few cars at every tick of a generation, for replaying them
+    without simulating. poses has shape (cars, ticks, 3) and is float32 to keep files small,
+    fitness holds the fitness of each car and deaths the tick each car died at (and stays still after).
+    '''
+
+    def __init__(self, poses, fitness, dt, generation, deaths=None):
+        self.poses = np.asarray(poses, np.float32)
+        self.fitness = np.asarray(fitness, float)
+        self.dt = dt
+        self.generation = generation
+        # Files saved without deaths have every car die on the last tick
+        self.deaths = (np.full(len(self.poses), self.poses.shape[1] - 1) if deaths is None
+                       else np.asarray(deaths, int))
+
+    def save(self, path):
+        atomic_write(path, self.write)
+
+    def write(self, f):
+        np.savez_compressed(f, poses=self.poses, fitness=self.fitness, dt=self.dt, generation=self.generation,
+                            deaths=self.deaths)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['poses'], data['fitness'], float(data['dt']), int(data['generation']),
+                       data['deaths'] if 'deaths' in data else None)
+
+class TrajectoryRecorder:
+    '''Records the pose of every live car of a population after each tick into a preallocated float32
+    ring buffer holding the last capacity ticks. At the end of a generation, the trajectories
+    of the best cars are taken from it with best(). As this takes capacity * 12 bytes per car,
+    replay_best() is better for large populations.
+
+        recorder.reset(population)
+        while ...:
+            population.update(dt, ...)
+            recorder.record(population)
+    '''
+
+    def __init__(self, size, capacity=3002):
+        self.capacity = capacity
+        self.poses = np.zeros((capacity, size, 3), np.float32)
+        # Last tick each car was recorded at, after which it stays where it died
+        self.last_tick = np.zeros(size, int)
+        self.ticks = 0
+
+    def reset(self, population):
+        '''Starts recording a new generation of population, from its starting poses.
+        '''
+
+        self.ticks = 0
+        self.live = np.arange(population.size)
+        self.record(population)
+
+    def record(self, population):
+        # Cars that were alive before this tick, so that the pose of cars that just died is recorded too
+        cars = self.live
+        self.live = population.live()
+
+        row = self.poses[self.ticks % self.capacity]
+        row[cars, :2] = population.pos[cars]
+        row[cars, 2] = population.angle[cars]
+        self.last_tick[cars] = self.ticks
+        self.ticks += 1
+
+    def best(self, population, count, dt, generation):
+        '''Returns the Trajectories of the count cars with the greatest fitness over the recorded ticks
+        (or the last capacity of them).
+        '''
+
+        return self.trajectories(population, np.argsort(population.fitness, kind='stable')[::-1][:count], dt,
+                                 generation)
+
+    def trajectories(self, population, cars, dt, generation):
+        '''Returns the Trajectories of cars (an array of indices) over the recorded ticks.
+        '''
+
+        ticks = np.arange(max(self.ticks - self.capacity, 0), self.ticks)
+
+        poses = self.poses[ticks[None] % self.capacity, cars[:, None]]
+        # After its last record, a car stays where it died, which is also where it is now
+        final = np.column_stack((population.pos[cars], population.angle[cars]))
+        after = ticks[None] > self.last_tick[cars, None]
+        poses[after] = np.broadcast_to(final[:, None], poses.shape)[after]
+
+        deaths = np.maximum(self.last_tick[cars] - ticks[0], 0)
+        return Trajectories(poses, population.fitness[cars], dt, generation, deaths)
+
+def replay_best(population, count, walls, wall_tree, dt, generation, distance_field=None):
+    '''Returns the Trajectories of the count cars of population with the greatest fitness, after an episode
+    updated dt at a time, by simulating them again on their own (before the population evolves).
+    Cars do not affect each other, so they drive the same way, and only count cars are ever recorded.
+    A car is held where it died after its lifespan, in case it was killed by a racing.cutoff.EarlyCutoff.
+    '''
+
+    cars = np.argsort(population.fitness, kind='stable')[::-1][:count]
+    start_pos = np.broadcast_to(population.start_pos, (population.size, 2))[cars]
+    start_angle = np.broadcast_to(population.start_angle, population.size)[cars]
+
+    replay = Population(start_pos[:, 0], start_pos[:, 1], start_angle, len(cars),
+                        num_sensors=len(population.sensor_angles), swept=population.swept, dtype=population.dtype)
+    replay.brain.set_genomes(population.brain.get_genomes()[cars])
+
+    # Half a tick short of the longest lifespan, so that the replay stops on the same tick however it is rounded
+    lifespans = population.lifespan[cars].astype(float)
+    ticks = np.round(lifespans / dt).astype(int)
+    recorder = TrajectoryRecorder(len(cars), ticks.max(initial=0) + 2)
+    replay.run_episode(walls, wall_tree, lifespans.max(initial=0) - dt / 2, dt, distance_field, recorder=recorder)
+
+    poses = recorder.trajectories(replay, np.arange(len(cars)), dt, generation).poses
+    deaths = np.minimum(ticks, poses.shape[1] - 1)
+    after = np.arange(poses.shape[1]) > deaths[:, None]
+    poses[after] = np.broadcast_to(poses[np.arange(len(cars)), deaths][:, None], poses.shape)[after]
+
+    return Trajectories(poses, population.fitness[cars], dt, generation, deaths)
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+import pytest
+
+from racing.aabb_tree import AABBTree
+from racing.bvh import BVH
+from racing.track import load_track
+
+TRACK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'saved', 'track')
+
+@pytest.fixture(scope='module')
+def walls():
+    return load_track(TRACK)
+
+@pytest.fixture(scope='module')
+def boxes(walls):
+    # Boxes of every size from a car to several walls, over the whole track and a bit around it
+    rng = np.random.default_rng(0)
+    points = walls.reshape(-1, 2)
+    corners = rng.uniform(points.min(axis=0) - 50, points.max(axis=0) + 50, (3000, 2))
+    sizes = rng.uniform(1, 200, (3000, 2))
+    return np.concatenate((corners, corners + sizes), axis=1)
+
+def brute_force(tree, walls, boxes):
+    wall_bbs = [tree.get_bounding_box([wall[:2], wall[2:]]) for wall in walls]
+    return [{i for i, wall_bb in enumerate(wall_bbs) if tree.intersects(wall_bb, tuple(box))} for box in boxes]
+
+def test_aabb_tree_query_matches_brute_force(walls, boxes):
+    tree = AABBTree()
+    for i, wall in enumerate(walls):
+        tree.add_leaf(tree.get_bounding_box([wall[:2], wall[2:]]), i)
+
+    found = tree.query([tuple(box) for box in boxes])
+    expected = brute_force(tree, walls, boxes)
+
+    assert sum(len(walls_hit) for walls_hit in expected) > 0
+    for result, walls_hit in zip(found, expected):
+        assert sorted(result) == sorted(walls_hit)
+
+def test_bvh_query_matches_brute_force(walls, boxes):
+    offsets, found = BVH(walls).query(boxes)
+    expected = brute_force(AABBTree(), walls, boxes)
+
+    for i, walls_hit in enumerate(expected):
+        assert found[offsets[i]:offsets[i + 1]].tolist() == sorted(walls_hit)
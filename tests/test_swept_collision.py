@@ -0,0 +1,32 @@
+import numpy as np
+
+from racing.bvh import BVH
+from racing.distance_field import DistanceField
+from racing.population import Population
+
+# A wall short enough to pass between the paths of the top and bottom corners of a car
+WALLS = np.array([[100, -4, 100, 4]], float)
+
+def drive_past(swept, distance_field=None):
+    # A car at x = 40 going 1200px/s to the right, whose (zero) brain neither turns nor accelerates
+    population = Population(40, 0, 0, 1, swept=swept)
+    population.brain.set_genomes(np.zeros_like(population.brain.get_genomes()))
+    population.vel[:] = [1200, 0]
+    # Collisions are tested before moving, so the second tick tests the move of the first
+    for _ in range(2):
+        population.update(0.1, WALLS, BVH(WALLS), distance_field)
+    return population
+
+def test_discrete_test_misses_short_wall():
+    assert not drive_past(False).dead[0]
+
+def test_swept_test_hits_short_wall():
+    population = drive_past(True)
+    assert population.dead[0]
+    # Moved back to where its front first touched the wall
+    assert np.isclose(population.pos[0, 0] + population.car_width / 2, 100)
+    # Without the movement past the wall in its fitness
+    assert np.isclose(population.total_movement[0], population.pos[0, 0] - 40)
+
+def test_swept_test_hits_short_wall_with_distance_field():
+    assert drive_past(True, DistanceField(WALLS, 4)).dead[0]